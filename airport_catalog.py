@@ -0,0 +1,119 @@
+import os
+import csv
+from html import escape
+
+from db_setup import airport_list_loc
+
+# The catalog names zones US/Central style (as do the pull code's zone
+# tables). Canonical names for the same zones are treated as equal.
+time_zone_aliases = {
+    'America/New_York'    : 'US/Eastern',
+    'America/Chicago'     : 'US/Central',
+    'America/Denver'      : 'US/Mountain',
+    'America/Los_Angeles' : 'US/Pacific',
+    'America/Anchorage'   : 'US/Alaska',
+    'Pacific/Honolulu'    : 'US/Hawaii',
+}
+
+
+class AirportCatalog:
+    # The airport list, loaded once and reloaded only when the file changes.
+    # Shared by the web app and the pull/ingest code.
+
+    def __init__(self, path):
+        self.path = path
+        self._mtime = None
+        self.reload_if_changed()
+
+    def reload_if_changed(self):
+        mtime = os.stat(self.path).st_mtime
+        if mtime != self._mtime:
+            self._load()
+            self._mtime = mtime
+
+    def _load(self):
+        with open(self.path, newline='') as f:
+            self._airports = list(csv.DictReader(f))
+
+        # Index by ICAO code
+        self._by_icao = {a['icao_designation'] : a for a in self._airports}
+
+        # Built lazily
+        self._df = None
+        self._dropdown_html = None
+
+    def __len__(self):
+        return len(self._airports)
+
+    def __iter__(self):
+        return iter(self._airports)
+
+    def __contains__(self, airport_name):
+        return airport_name in self._by_icao
+
+    def lookup(self, airport_name):
+        # Row for the airport as a dict, or None if it is not in the list
+        return self._by_icao.get(airport_name)
+
+    def time_zone(self, airport_name, default = 'UTC'):
+        airport_row = self._by_icao.get(airport_name)
+        return airport_row['time_zone'] if airport_row is not None else default
+
+    def icao_codes(self):
+        return [a['icao_designation'] for a in self._airports]
+
+    def by_time_zone(self, tz_str):
+        return [a for a in self._airports if a['time_zone'] == tz_str]
+
+    def by_state(self, state):
+        return [a for a in self._airports if a['state'] == state]
+
+    def select(self, airports = None, state = None, time_zone = None):
+        # ICAO codes from an explicit list, else the airports matching the
+        # state and/or time zone, else every airport. Unknown codes are
+        # dropped from an explicit list.
+        if airports:
+            return [a for a in airports if a in self._by_icao]
+
+        airport_rows = self._airports
+        if state is not None:
+            airport_rows = [a for a in airport_rows if a['state'] == state]
+        if time_zone is not None:
+            time_zone = time_zone_aliases.get(time_zone, time_zone)
+            airport_rows = [a for a in airport_rows
+                            if time_zone_aliases.get(a['time_zone'], a['time_zone']) == time_zone]
+
+        return [a['icao_designation'] for a in airport_rows]
+
+    @property
+    def df(self):
+        # pandas is only imported by the code paths that need a data frame
+        if self._df is None:
+            import pandas as pd
+            self._df = pd.read_csv(self.path)
+        return self._df
+
+    def dropdown_html(self):
+        # <option> elements for the airport selection list
+        if self._dropdown_html is None:
+            options = [
+                '<option value="{0}"> {1}, {2} ({0}) </option>'.format(
+                    escape(a['icao_designation']), escape(a['city']), escape(a['state'])
+                )
+                for a in self._airports
+            ]
+            self._dropdown_html = '\n'.join(options)
+        return self._dropdown_html
+
+
+_airport_catalogs = {}
+
+def get_airport_catalog(path = airport_list_loc):
+    # Shared catalog for the path, reloaded if the file has changed
+    airport_catalog = _airport_catalogs.get(path)
+    if airport_catalog is None:
+        airport_catalog = _airport_catalogs[path] = AirportCatalog(path)
+    else:
+        airport_catalog.reload_if_changed()
+
+    return airport_catalog
@@ -0,0 +1,303 @@
+import os, sys
+import argparse
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from airport_catalog import get_airport_catalog
+from db_connections import get_write_connection
+from update_weather_db import prepare_avf_compare, insert_avf_compare, delete_avf_compare
+from rollups import rebuild_avf_rollup
+from loader_memo import loader_memo
+from response_cache import bump_data_generation
+
+# Recompute actual-vs-forecast comparisons over a range of dates for a set
+# of airports. The comparisons are computed in a pool of worker processes,
+# which only read from the db. This process is the single writer: results
+# are inserted in batches, one transaction per batch, together with the
+# checkpoint rows for the batch. An interrupted run picks up where it
+# stopped when run again with the same arguments.
+#
+#   python backfill_avf.py 2019-08-01 2020-07-31 --state TX --processes 8
+#
+# By default dates that already have comparison rows are skipped, so only
+# gaps are filled. With --recompute every date in the range is computed
+# again and its rows replaced. A recompute run checkpoints under a run id
+# (printed at the start); pass it back with --run-id to resume the run
+# where it stopped. The AvF rollup of the airports is rebuilt at the end.
+#
+# With --recompute-precip, dates whose rows predate the fix to the
+# interpolated precipitation probability (fcst_precip_prob held the wind
+# speed, so prob_precip_delta was left NULL) are computed again and their
+# rows replaced. The AvF rollup of the airports is rebuilt at the end.
+
+
+def date_range(start_date_str, end_date_str):
+    # Dates from start to end, inclusive
+    date_time = datetime.strptime(start_date_str, '%Y-%m-%d')
+    end_date_time = datetime.strptime(end_date_str, '%Y-%m-%d')
+
+    date_strs = []
+    while date_time <= end_date_time:
+        date_strs.append(date_time.strftime('%Y-%m-%d'))
+        date_time = date_time + timedelta(days = 1)
+
+    return date_strs
+
+
+def select_airports(airport_catalog, airports = None, state = None, time_zone = None):
+    # Explicit list, else filtered catalog, else every airport
+    if airports:
+        unknown = [a for a in airports if a not in airport_catalog]
+        if unknown:
+            raise ValueError('unknown airports: {0}'.format(', '.join(unknown)))
+
+    return airport_catalog.select(airports, state, time_zone)
+
+
+def get_completed_tasks(db_conn, start_date_str, end_date_str):
+    # (airport, date) pairs already done, either by an earlier backfill or
+    # because the comparisons were loaded by the nightly update
+    cur = db_conn.cursor()
+    cur.execute(
+        '''
+        SELECT airport_name, fcst_date
+        FROM weather_avf_backfill
+        WHERE status = 'done'
+        AND fcst_date >= ?
+        AND fcst_date <= ?
+        UNION
+        SELECT DISTINCT airport_name, substr(datetime, 1, 10)
+        FROM weather_avf_compare
+        WHERE datetime >= ?
+        AND datetime <  ?
+        ''',
+        (start_date_str, end_date_str, start_date_str,
+         (datetime.strptime(end_date_str, '%Y-%m-%d') + timedelta(days = 1)).strftime('%Y-%m-%d'))
+    )
+    return set(cur.fetchall())
+
+
+def get_run_completed_tasks(db_conn, run_id, start_date_str, end_date_str):
+    # (airport, date) pairs already redone by this recompute run
+    cur = db_conn.cursor()
+    cur.execute(
+        '''
+        SELECT airport_name, fcst_date
+        FROM weather_avf_backfill
+        WHERE status = 'done'
+        AND run_id = ?
+        AND fcst_date >= ?
+        AND fcst_date <= ?
+        ''',
+        (run_id, start_date_str, end_date_str)
+    )
+    return set(cur.fetchall())
+
+
+def get_stale_precip_tasks(db_conn, start_date_str, end_date_str):
+    # (airport, date) pairs with rows written before the precipitation
+    # probability fix. Later rows always have prob_precip_delta when
+    # matched to an observation.
+    cur = db_conn.cursor()
+    cur.execute(
+        '''
+        SELECT DISTINCT airport_name, substr(datetime, 1, 10)
+        FROM weather_avf_compare
+        WHERE datetime >= ?
+        AND datetime <  ?
+        AND prob_precip_delta IS NULL
+        AND fcst_precip_prob IS NOT NULL
+        AND (air_temp IS NOT NULL OR wind_speed IS NOT NULL)
+        ''',
+        (start_date_str,
+         (datetime.strptime(end_date_str, '%Y-%m-%d') + timedelta(days = 1)).strftime('%Y-%m-%d'))
+    )
+    return set(cur.fetchall())
+
+
+def compute_task(airport_name, fcst_date_str):
+    # Runs in a worker process. Errors are returned rather than raised so
+    # they can be checkpointed along with the successes.
+    try:
+        with loader_memo():
+            df_avf_compare = prepare_avf_compare(airport_name, fcst_date_str)
+        return airport_name, fcst_date_str, df_avf_compare, None
+    except Exception as e:
+        return airport_name, fcst_date_str, None, repr(e)
+
+
+def write_batch(db_conn, results, replace = False, run_id = None):
+    # One transaction for the comparisons, rollups and checkpoints of a
+    # batch. With replace, existing rows for the dates are deleted first and
+    # the rollup is left for the caller to rebuild. Checkpoints are tagged
+    # with run_id.
+    n_rows = 0
+    checkpoints = []
+    updated_at = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+
+    try:
+        for airport_name, fcst_date_str, df_avf_compare, error in results:
+            if error is None:
+                if replace:
+                    delete_avf_compare(db_conn, airport_name, fcst_date_str)
+                insert_avf_compare(db_conn, airport_name, fcst_date_str, df_avf_compare,
+                                   update_rollup = not replace)
+                n_rows += len(df_avf_compare)
+                checkpoints.append((airport_name, fcst_date_str, 'done',
+                                    len(df_avf_compare), None, updated_at, run_id))
+            else:
+                checkpoints.append((airport_name, fcst_date_str, 'failed',
+                                    None, error, updated_at, run_id))
+
+        db_conn.executemany(
+            '''
+            INSERT OR REPLACE INTO weather_avf_backfill (
+             airport_name, fcst_date, status, n_rows, message, updated_at, run_id
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''',
+            checkpoints
+        )
+        db_conn.commit()
+
+    except Exception:
+        db_conn.rollback()
+        raise
+
+    return n_rows
+
+
+def new_run_id():
+    return datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+
+
+def run_backfill(db_conn, airport_list, date_strs, processes = None,
+                 batch_size = 50, recompute_precip = False, run_id = None):
+    # With run_id, a recompute: every date is redone and its rows replaced,
+    # skipping only what this run has already checkpointed
+    replace = recompute_precip or run_id is not None
+
+    if run_id is not None:
+        completed = get_run_completed_tasks(db_conn, run_id, date_strs[0], date_strs[-1])
+        tasks = [(airport_name, date_str)
+                 for date_str in date_strs
+                 for airport_name in airport_list
+                 if (airport_name, date_str) not in completed]
+    elif recompute_precip:
+        # Only the dates with stale rows. Rerunning picks up what is left.
+        stale = get_stale_precip_tasks(db_conn, date_strs[0], date_strs[-1])
+        tasks = [(airport_name, date_str)
+                 for date_str in date_strs
+                 for airport_name in airport_list
+                 if (airport_name, date_str) in stale]
+    else:
+        # Skip anything already done
+        completed = get_completed_tasks(db_conn, date_strs[0], date_strs[-1])
+        tasks = [(airport_name, date_str)
+                 for date_str in date_strs
+                 for airport_name in airport_list
+                 if (airport_name, date_str) not in completed]
+
+    print('{0} of {1} airport dates to compute'.format(
+        len(tasks), len(date_strs) * len(airport_list)))
+
+    n_done = n_failed = n_rows = 0
+    results = []
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    with ProcessPoolExecutor(max_workers = processes) as executor:
+        # Bound the work in flight so results do not pile up in memory
+        max_pending = 4 * processes
+        task_iter = iter(tasks)
+        pending = set()
+
+        while True:
+            for airport_name, date_str in task_iter:
+                pending.add(executor.submit(compute_task, airport_name, date_str))
+                if len(pending) >= max_pending:
+                    break
+
+            if not pending:
+                break
+
+            finished, pending = wait(pending, return_when = FIRST_COMPLETED)
+            for future in finished:
+                result = future.result()
+                results.append(result)
+                if result[3] is None:
+                    n_done += 1
+                else:
+                    n_failed += 1
+                    print('AvF failed for {0} on {1}: {2}'.format(result[0], result[1], result[3]))
+
+            if len(results) >= batch_size:
+                n_rows += write_batch(db_conn, results, replace, run_id)
+                results = []
+                print('{0} done, {1} failed, {2} remaining'.format(
+                    n_done, n_failed, len(tasks) - n_done - n_failed))
+
+    if results:
+        n_rows += write_batch(db_conn, results, replace, run_id)
+
+    # Replaced rows were not folded in incrementally. Rebuilt even when
+    # nothing was left to do, in case an earlier run stopped before this.
+    if replace:
+        for airport_name in airport_list:
+            rebuild_avf_rollup(db_conn, airport_name)
+
+    print('Backfill finished: {0} done, {1} failed, {2} rows inserted'.format(
+        n_done, n_failed, n_rows))
+
+    return n_rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description = 'Recompute actual vs forecast comparisons for a date range'
+    )
+    parser.add_argument('start_date', help = 'first comparison date, YYYY-MM-DD')
+    parser.add_argument('end_date', nargs = '?', default = None,
+                        help = 'last comparison date, YYYY-MM-DD (default: start_date)')
+    parser.add_argument('--airports', nargs = '+', default = None,
+                        help = 'ICAO codes (default: every airport in the list)')
+    parser.add_argument('--state', default = None)
+    parser.add_argument('--time-zone', default = None)
+    parser.add_argument('--processes', type = int, default = os.cpu_count())
+    parser.add_argument('--batch-size', type = int, default = 50,
+                        help = 'airport dates written per transaction')
+    recompute = parser.add_mutually_exclusive_group()
+    recompute.add_argument('--recompute', action = 'store_true',
+                           help = 'recompute every date and replace its rows')
+    recompute.add_argument('--recompute-precip', action = 'store_true',
+                           help = 'recompute dates written before the precipitation probability fix')
+    parser.add_argument('--run-id', default = None,
+                        help = 'resume the --recompute run with this id')
+    args = parser.parse_args()
+
+    if args.run_id is not None and not args.recompute:
+        parser.error('--run-id needs --recompute')
+
+    end_date = args.end_date if args.end_date is not None else args.start_date
+    date_strs = date_range(args.start_date, end_date)
+    if not date_strs:
+        sys.exit('end date is before start date')
+
+    airport_list = select_airports(get_airport_catalog(), args.airports,
+                                   args.state, args.time_zone)
+
+    # Opened (and migrated) before the workers start reading
+    db_conn = get_write_connection()
+
+    run_id = None
+    if args.recompute:
+        run_id = args.run_id if args.run_id is not None else new_run_id()
+        print('Recompute run {0}. Resume it with --recompute --run-id {0}'.format(run_id))
+
+    n_rows = run_backfill(db_conn, airport_list, date_strs,
+                          args.processes, args.batch_size, args.recompute_precip, run_id)
+
+    # Invalidate cached heatmaps built from the previous data
+    if n_rows > 0 or args.recompute or args.recompute_precip:
+        bump_data_generation()
@@ -0,0 +1,103 @@
+import sys
+import glob
+import time
+import argparse
+import statistics
+
+from pull_weather import ObsTableExtractor, parse_nws_actl_raw
+from raw_archive import get_raw_archive
+
+# Throughput of the obhistory parser over saved pages, read from the raw
+# archive (see raw_archive.py) or from loose files, e.g.
+#
+#   python benchmark_actl_parse.py --archive /data/weather --start 2019-08-01
+#   python benchmark_actl_parse.py '/data/weather/*/nws_actl_*.html'
+#
+# Reading from the archive also times the sequential read of the pages.
+# With bs4 installed, the table extraction is also timed against the
+# BeautifulSoup scraping it replaced, and the cell text of the two is
+# checked to match.
+
+
+def bs4_extract(req_text):
+     # The table extraction parse_nws_actl_raw used to do
+     from bs4 import BeautifulSoup
+
+     soup = BeautifulSoup(req_text, 'html.parser')
+     table = soup.find_all('table')[3]
+     table_head = [th.text for th in table.find_all('th') if 'Time' in th]
+     table_rows = table.find_all('tr')[3:][:-3]
+     table_data = [[td.text for td in tr.find_all('td')] for tr in table_rows]
+     return table_head, table_data
+
+
+def fast_extract(req_text):
+     table_head, table_rows = ObsTableExtractor().extract(req_text)
+     table_head = [''.join(th) for th in table_head if 'Time' in th]
+     return table_head, table_rows[3:][:-3]
+
+
+def time_over_corpus(func, pages, runs):
+     # Best of the runs: seconds for one pass over every page
+     run_secs = []
+     for _ in range(runs):
+          t0 = time.perf_counter()
+          for req_text in pages:
+               func(req_text)
+          run_secs.append(time.perf_counter() - t0)
+     return min(run_secs), statistics.median(run_secs)
+
+
+if __name__ == '__main__':
+     parser = argparse.ArgumentParser(description = 'Time parsing of saved nws_actl_*.html pages')
+     parser.add_argument('patterns', nargs = '*', help = 'loose files or glob patterns')
+     parser.add_argument('--archive', default = None, help = 'raw archive root')
+     parser.add_argument('--airport', default = None)
+     parser.add_argument('--start', default = None, help = 'first date, YYYY-MM-DD')
+     parser.add_argument('--end', default = None, help = 'last date, YYYY-MM-DD')
+     parser.add_argument('--runs', type = int, default = 3)
+     args = parser.parse_args()
+
+     if args.archive is not None:
+          archive = get_raw_archive(args.archive)
+          t0 = time.perf_counter()
+          entries = list(archive.entries(airport_name = args.airport, kind = 'actl',
+                                         start_date = args.start, end_date = args.end))
+          t_read = time.perf_counter() - t0
+          paths = ['{0} {1}'.format(airport, date_str) for airport, _, date_str, _ in entries]
+          pages = [text for _, _, _, text in entries]
+          if len(pages) == 0:
+               sys.exit('No actl pages in the archive at {0}'.format(args.archive))
+          print('Read {0} pages from the archive in {1:.3f} s'.format(len(pages), t_read))
+     elif args.patterns:
+          paths = sorted(set(p for pattern in args.patterns for p in glob.glob(pattern)))
+          if len(paths) == 0:
+               sys.exit('No files match {0}'.format(' '.join(args.patterns)))
+
+          pages = []
+          for path in paths:
+               with open(path) as f:
+                    pages.append(f.read())
+     else:
+          parser.error('give --archive or file patterns')
+
+     n_mb = sum(len(p) for p in pages) / 1e6
+     print('{0} pages, {1:.1f} MB'.format(len(pages), n_mb))
+
+     to_time = [('extract', fast_extract), ('parse_nws_actl_raw', parse_nws_actl_raw)]
+     try:
+          import bs4
+     except ImportError:
+          print('bs4 not installed, skipping the BeautifulSoup comparison')
+     else:
+          to_time.insert(0, ('bs4 extract', bs4_extract))
+          mismatched = [path for path, req_text in zip(paths, pages)
+                        if bs4_extract(req_text) != fast_extract(req_text)]
+          print('Cell text differs from bs4 for {0} of {1} pages'.format(len(mismatched), len(pages)))
+          for path in mismatched[:10]:
+               print('  {0}'.format(path))
+
+     for name, func in to_time:
+          best, median = time_over_corpus(func, pages, args.runs)
+          print('{0:>20} : {1:8.1f} pages/s, {2:6.2f} MB/s (median pass {3:.2f} s)'.format(
+               name, len(pages) / best, n_mb / best, median))
@@ -0,0 +1,79 @@
+import os, sys
+import json
+import argparse
+import statistics
+import subprocess
+
+# Cold start of a web app worker: time to import weatherapp and latency of
+# the first requests, each run in a fresh interpreter as a respawned uWSGI
+# worker would be.
+#
+#   python benchmark_startup.py --airport KORD --runs 10
+
+worker_script = r'''
+import sys, json, time, tempfile, os
+
+t0 = time.perf_counter()
+import weatherapp
+t_import = time.perf_counter() - t0
+
+# Empty response cache, so the heatmap is computed every run
+import response_cache
+response_cache.response_cache_loc = os.path.join(tempfile.mkdtemp(), 'cache.sqlite')
+
+heavy_after_import = sorted(m for m in ('numpy', 'pandas', 'scipy') if m in sys.modules)
+
+client = weatherapp.app.test_client()
+timings = {'import' : t_import}
+for name, url in json.loads(sys.argv[1]):
+    t0 = time.perf_counter()
+    response = client.get(url)
+    timings[name] = time.perf_counter() - t0
+    if response.status_code != 200:
+        timings[name + '_status'] = response.status_code
+    elif response.is_json:
+        # Row count, so a query matching nothing shows up
+        timings[name + '_rows'] = len(response.get_json())
+
+print(json.dumps({'timings' : timings, 'heavy_after_import' : heavy_after_import}))
+'''
+
+
+def run_once(requests_to_time):
+    out = subprocess.run(
+        [sys.executable, '-c', worker_script, json.dumps(requests_to_time)],
+        cwd = os.path.dirname(os.path.abspath(__file__)),
+        check = True, capture_output = True, text = True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Time weatherapp import and first requests')
+    parser.add_argument('--airport', default = 'KORD')
+    parser.add_argument('--start', default = '2019-08-17')
+    parser.add_argument('--end', default = '2019-08-20')
+    parser.add_argument('--runs', type = int, default = 5)
+    args = parser.parse_args()
+
+    # In order, in the same worker: the first query pays for the db
+    # connection, the heatmap for pandas
+    requests_to_time = [
+        ('first_query', '/weather-app/query?af_type=fcst&airport={0}&start_date_str={1}&end_date_str={2}'.format(
+            args.airport, args.start, args.end)),
+        ('second_query', '/weather-app/query?af_type=actl&airport={0}&start_date_str={1}&end_date_str={2}'.format(
+            args.airport, args.start, args.end)),
+        ('first_heatmap', '/weather-app/avf_heatmap?airport={0}&stat=rmse'.format(args.airport)),
+    ]
+
+    results = [run_once(requests_to_time) for _ in range(args.runs)]
+
+    print('Heavy modules loaded by import weatherapp: {0}'.format(
+        ', '.join(results[0]['heavy_after_import']) or 'none'))
+    for name in results[0]['timings']:
+        values = [r['timings'][name] for r in results if name in r['timings']]
+        if name.endswith('_status') or name.endswith('_rows'):
+            print('{0:>18} : {1}'.format(name, values[0]))
+        else:
+            print('{0:>18} : median {1:8.1f} ms, min {2:8.1f} ms over {3} runs'.format(
+                name, 1000 * statistics.median(values), 1000 * min(values), len(values)))
@@ -4,6 +4,10 @@ import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 from db_setup import *
+from airport_catalog import get_airport_catalog
+from db_connections import get_write_connection
+from response_cache import bump_data_generation
+from time_columns import fill_time_columns
 
 # Basic set-up
 if len(sys.argv) > 1:
@@ -17,12 +21,11 @@ else:
     tomm_dt  = '2019-11-02'
 
 # Airport list
-df_airport   = pd.read_csv(airport_list_loc)
-airport_list = df_airport['icao_designation'].to_list()
+airport_list = get_airport_catalog().icao_codes()
 
 # Set up the database for
 sqlite_file = weather_db_loc
-conn    = sqlite3.connect(sqlite_file)
+conn    = get_write_connection(sqlite_file)
 cur     = conn.cursor()
 
 columns = ['datetime', 'date', 'time', 'wind_raw', 'wind_dir', 'wind_speed',
@@ -82,6 +85,7 @@ for airport in airport_list:
                 
         df_airport = df_airport[columns]
         df_airport.to_sql('weather_actl', index=False, con = conn, if_exists='append')
+        fill_time_columns(conn, 'weather_actl', airport)
 
     # Either the data did not exist, or the data has already been loaded
     else:
@@ -94,3 +98,6 @@ for airport in airport_list:
             print('Found {0} records for {1} on {2} in the database.'.format(
                 len(query_result), airport, actl_dt)
             )
+
+# Invalidate cached responses built from the previous data
+bump_data_generation()
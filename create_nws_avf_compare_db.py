@@ -1,87 +1,24 @@
 import os, sys
-import sqlite3
-import numpy as np
-import pandas as pd
-from datetime import datetime, timedelta
-from time import sleep
 
-from db_setup import weather_db_loc, airport_list_loc
-from forecast_tools import get_avf_compare, get_fcst, get_actl
+from airport_catalog import get_airport_catalog
+from db_connections import get_write_connection
+from response_cache import bump_data_generation
+from update_weather_db import update_avf_db_from_list
 
-# Basic set-up
+# Basic set-up. Use backfill_avf.py for ranges of dates.
 if len(sys.argv) > 1:
     date_str = sys.argv[1]
 else:
     date_str = '2019-08-17'
 
 # Airport list
-df_airport   = pd.read_csv(airport_list_loc)
-airport_list = df_airport['icao_designation'].to_list()
+airport_list = get_airport_catalog().icao_codes()
 
 # Set up the database for
-sqlite_file = weather_db_loc
-conn    = sqlite3.connect(sqlite_file)
-cur     = conn.cursor()
-
-columns = ['airport_name', 'pull_date', 'datetime', 'interp_seconds',
-           'interp_day', 'interp_hour', 'fcst_temperature', 'fcst_wind_speed',
-           'fcst_precip_prob', 'air_temp', 'wind_speed',
-           'precip_1_hour', 'temp_delta', 'wind_speed_delta']
+conn = get_write_connection()
 
 # Load data for each airport
-for airport in airport_list:
-
-    # Check to see if the weather forecast table exists
-    cur.execute('''
-        SELECT name 
-        FROM sqlite_master 
-        WHERE type='table' 
-        AND name='weather_avf_compare'
-    ''')
-    table_query_result = cur.fetchone()
+update_avf_db_from_list(conn, airport_list, date_str)
 
-    # If the table exists, see if the data has been loaded
-    if table_query_result is not None:
-        # date range to pull
-        date_time = datetime.strptime(date_str, '%Y-%m-%d')
-        first_pull_dt = (date_time + timedelta(days = 0)).strftime('%Y-%m-%d')
-        last_pull_dt =  (date_time + timedelta(days = 1)).strftime('%Y-%m-%d')
-        
-        query_params = (airport, first_pull_dt, last_pull_dt)
-        cur.execute(
-            '''
-            SELECT * 
-            FROM weather_avf_compare 
-            WHERE airport_name = ?
-            AND datetime >= ?
-            AND datetime <  ?
-            ''',
-            query_params
-        )
-        query_result = cur.fetchall()
-    else:
-        query_result = None
-        
-    # Data exists and nothing found on the table so far
-    if (query_result is None or len(query_result) == 0):
-        try:
-            df_avf_compare = get_avf_compare(airport, date_str)
-            df_avf_compare['airport_name'] = airport
-            
-            for c in columns:
-                if c not in df_avf_compare.columns:
-                    df_avf_compare[c] = np.nan
-                    
-            df_avf_compare = df_avf_compare[columns]
-            df_avf_compare.to_sql('weather_avf_compare', index=False, con = conn, if_exists='append')
-            
-        except:
-            print('something went wrong with {0} for {1}'.format(airport, date_str))
-            
-    # Either the data did not exist, or the data has already been loaded
-    else:
-        # Data already loaded
-        if query_result is not None:
-            print('Found {0} records for {1} on {2} in the database.'.format(
-                len(query_result), airport, date_str)
-            )
+# Invalidate cached responses built from the previous data
+bump_data_generation()
@@ -4,6 +4,11 @@ import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 from db_setup import *
+from rollups import update_fvf_rollup
+from airport_catalog import get_airport_catalog
+from db_connections import get_write_connection
+from response_cache import bump_data_generation
+from time_columns import fill_time_columns
 
 # Basic set-up
 if len(sys.argv) > 1:
@@ -16,12 +21,11 @@ else:
     fcst_dt  = '2019-08-13'
 
 # Airport list
-df_airport   = pd.read_csv(os.path.join(data_input_root, 'airports.csv'))
-airport_list = df_airport['icao_designation'].to_list()
+airport_list = get_airport_catalog().icao_codes()
 
 # Set up the database for
 sqlite_file = weather_db_loc #os.path.join(db_dir, 'weather.sqlite')
-conn    = sqlite3.connect(sqlite_file)
+conn    = get_write_connection(sqlite_file)
 cur     = conn.cursor()
 
 columns = ['airport_name', 'pull_date', 'forecast_time_stamps', 'temperature_dew_point',
@@ -77,6 +81,8 @@ for airport in airport_list:
                 
         df_airport = df_airport[columns]
         df_airport.to_sql('weather_fcst', index=False, con = conn, if_exists='append')
+        fill_time_columns(conn, 'weather_fcst', airport)
+        update_fvf_rollup(conn, airport, fcst_dt)
 
     # Either the data did not exist, or the data has already been loaded
     else:
@@ -89,3 +95,6 @@ for airport in airport_list:
             print('Found {0} records for {1} on {2} in the database.'.format(
                 len(query_result), airport, fcst_dt)
             )
+
+# Invalidate cached responses built from the previous data
+bump_data_generation()
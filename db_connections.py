@@ -0,0 +1,73 @@
+import os
+import sqlite3
+import pathlib
+import threading
+
+from db_setup import weather_db_loc
+from db_schema import migrate
+
+# Applied to every reader connection
+read_pragmas = [
+    'PRAGMA query_only = ON',
+    'PRAGMA mmap_size = 268435456',
+    'PRAGMA cache_size = -65536',
+    'PRAGMA temp_store = MEMORY',
+]
+
+# Applied to the writer connection. WAL lets readers carry on while the
+# ingest writes.
+write_pragmas = [
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -65536',
+]
+
+# Reader connections are kept per thread. uWSGI forks its workers, so
+# connections are also keyed on the process id and never cross a fork.
+_readers = threading.local()
+
+_writers = {}
+_writers_pid = None
+
+
+def open_read_connection(db_loc = weather_db_loc):
+    db_uri = pathlib.Path(db_loc).absolute().as_uri() + '?mode=ro'
+    db_conn = sqlite3.connect(db_uri, uri = True, timeout = 10)
+    for pragma in read_pragmas:
+        db_conn.execute(pragma)
+
+    return db_conn
+
+
+def get_read_connection(db_loc = weather_db_loc):
+    # Reused read-only connection for this thread
+    conns = getattr(_readers, 'conns', None)
+    if conns is None or _readers.pid != os.getpid():
+        conns = _readers.conns = {}
+        _readers.pid = os.getpid()
+
+    db_conn = conns.get(db_loc)
+    if db_conn is None:
+        db_conn = conns[db_loc] = open_read_connection(db_loc)
+
+    return db_conn
+
+
+def get_write_connection(db_loc = weather_db_loc):
+    # The single writer connection for this process
+    global _writers_pid
+
+    if _writers_pid != os.getpid():
+        _writers.clear()
+        _writers_pid = os.getpid()
+
+    db_conn = _writers.get(db_loc)
+    if db_conn is None:
+        db_conn = _writers[db_loc] = sqlite3.connect(db_loc, timeout = 30)
+        for pragma in write_pragmas:
+            db_conn.execute(pragma)
+
+        # Tables, indexes and any pending upgrades
+        migrate(db_conn)
+
+    return db_conn
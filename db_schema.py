@@ -0,0 +1,336 @@
+import sqlite3
+
+from time_columns import time_column_tables, fill_time_columns
+
+# Table definitions. Existing tables built by to_sql are left as they are.
+table_ddl = [
+    '''
+    CREATE TABLE IF NOT EXISTS weather_fcst (
+     airport_name                          TEXT
+    ,pull_date                             TEXT
+    ,forecast_time_stamps                  TEXT
+    ,temperature_dew_point                 REAL
+    ,temperature_heat_index                REAL
+    ,wind_speed_sustained                  REAL
+    ,cloud_amount_total                    REAL
+    ,probability_of_precipitation_floating REAL
+    ,humidity_relative                     REAL
+    ,direction_wind                        REAL
+    ,temperature_hourly                    REAL
+    ,wind_speed_gust                       REAL
+    ,hourly_qpf_floating                   REAL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS weather_actl (
+     datetime          TEXT
+    ,date              INTEGER
+    ,time              TEXT
+    ,wind_raw          TEXT
+    ,wind_dir          TEXT
+    ,wind_speed        REAL
+    ,gust_speed        REAL
+    ,visibility        REAL
+    ,weather           TEXT
+    ,sky_conditions    TEXT
+    ,air_temp          REAL
+    ,dew_point         REAL
+    ,temp_6_hour_max   REAL
+    ,temp_6_hour_min   REAL
+    ,relative_humidity REAL
+    ,wind_chill        REAL
+    ,heat_index        REAL
+    ,pressure          REAL
+    ,pressure_mb       REAL
+    ,precip_1_hour     REAL
+    ,precip_3_hour     REAL
+    ,precip_6_hour     REAL
+    ,airport_name      TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS weather_avf_compare (
+     airport_name     TEXT
+    ,pull_date        TEXT
+    ,datetime         TEXT
+    ,interp_seconds   REAL
+    ,interp_day       INTEGER
+    ,interp_hour      INTEGER
+    ,fcst_temperature REAL
+    ,fcst_wind_speed  REAL
+    ,fcst_precip_prob REAL
+    ,air_temp         REAL
+    ,wind_speed       REAL
+    ,precip_1_hour    REAL
+    ,temp_delta       REAL
+    ,wind_speed_delta REAL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS weather_fvf_rollup (
+     airport_name          TEXT    NOT NULL
+    ,day_of_snp1           INTEGER NOT NULL
+    ,day_of_snp2           INTEGER NOT NULL
+    ,fcst_hour             INTEGER NOT NULL
+    ,sum_temp_delta        REAL    NOT NULL DEFAULT 0
+    ,cnt_temp_delta        INTEGER NOT NULL DEFAULT 0
+    ,sum_prob_precip_delta REAL    NOT NULL DEFAULT 0
+    ,cnt_prob_precip_delta INTEGER NOT NULL DEFAULT 0
+    ,sum_wind_speed_delta  REAL    NOT NULL DEFAULT 0
+    ,cnt_wind_speed_delta  INTEGER NOT NULL DEFAULT 0
+    ,cnt_snp2_v_snp1       INTEGER NOT NULL DEFAULT 0
+    ,PRIMARY KEY (airport_name, day_of_snp1, day_of_snp2, fcst_hour)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS weather_avf_rollup (
+     airport_name           TEXT    NOT NULL
+    ,interp_day             INTEGER NOT NULL
+    ,interp_hour            INTEGER NOT NULL
+    ,sum_temp_delta         REAL    NOT NULL DEFAULT 0
+    ,sumsq_temp_delta       REAL    NOT NULL DEFAULT 0
+    ,cnt_temp_delta         INTEGER NOT NULL DEFAULT 0
+    ,sum_wind_speed_delta   REAL    NOT NULL DEFAULT 0
+    ,sumsq_wind_speed_delta REAL    NOT NULL DEFAULT 0
+    ,cnt_wind_speed_delta   INTEGER NOT NULL DEFAULT 0
+    ,PRIMARY KEY (airport_name, interp_day, interp_hour)
+    )
+    ''',
+]
+
+# Indexes for the hot queries. The trailing columns make them covering for
+# the web app's range queries, so those never touch the tables.
+index_ddl = [
+    '''
+    CREATE INDEX IF NOT EXISTS weather_fcst_airport_time
+    ON weather_fcst (
+     airport_name, forecast_time_stamps, pull_date
+    ,wind_speed_sustained, probability_of_precipitation_floating, temperature_hourly
+    )
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS weather_fcst_airport_pull
+    ON weather_fcst (airport_name, pull_date)
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS weather_actl_airport_time
+    ON weather_actl (
+     airport_name, datetime
+    ,weather, wind_speed, precip_1_hour, air_temp
+    )
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS weather_avf_compare_airport_cell
+    ON weather_avf_compare (
+     airport_name, interp_day, interp_hour
+    ,temp_delta, wind_speed_delta
+    )
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS weather_avf_compare_airport_time
+    ON weather_avf_compare (airport_name, datetime)
+    ''',
+]
+
+
+# Indexes on the integer time columns. These replace the covering indexes
+# on the text time stamps for the range queries.
+time_index_ddl = [
+    'DROP INDEX IF EXISTS weather_fcst_airport_time',
+    'DROP INDEX IF EXISTS weather_actl_airport_time',
+    '''
+    CREATE INDEX IF NOT EXISTS weather_fcst_airport_epoch
+    ON weather_fcst (
+     airport_name, forecast_utc_epoch, pull_date, forecast_time_stamps
+    ,wind_speed_sustained, probability_of_precipitation_floating, temperature_hourly
+    )
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS weather_actl_airport_epoch
+    ON weather_actl (
+     airport_name, datetime_utc_epoch, datetime
+    ,weather, wind_speed, precip_1_hour, air_temp
+    )
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS weather_actl_airport_time
+    ON weather_actl (airport_name, datetime)
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS weather_avf_compare_airport_epoch
+    ON weather_avf_compare (airport_name, datetime_utc_epoch)
+    ''',
+]
+
+
+def migration_create_tables(db_conn):
+    for ddl in table_ddl:
+        db_conn.execute(ddl)
+
+
+def migration_create_indexes(db_conn):
+    for ddl in index_ddl:
+        db_conn.execute(ddl)
+    db_conn.execute('ANALYZE')
+
+
+def migration_rebuild_rollups(db_conn):
+    # Fill the rollups from any history loaded before they existed. The
+    # rollup SQL targets the final schema, so ask migrate() for the rebuild
+    # rather than running it against this version's tables.
+    return True
+
+
+def migration_add_time_columns(db_conn):
+    # Integer UTC epoch and local hour columns, backfilled for history
+    for table_name, (_, columns) in time_column_tables.items():
+        for column_name in columns:
+            db_conn.execute(
+                'ALTER TABLE {0} ADD COLUMN {1} INTEGER'.format(table_name, column_name)
+            )
+        fill_time_columns(db_conn, table_name)
+
+    for ddl in time_index_ddl:
+        db_conn.execute(ddl)
+    db_conn.execute('ANALYZE')
+
+    # The fvf rollup is now keyed on the integer columns, so rebuild both
+    # rollups once the time columns are filled
+    return True
+
+
+# Progress of backfill_avf.py, one row per airport and comparison date
+backfill_ddl = '''
+    CREATE TABLE IF NOT EXISTS weather_avf_backfill (
+     airport_name TEXT NOT NULL
+    ,fcst_date    TEXT NOT NULL
+    ,status       TEXT NOT NULL
+    ,n_rows       INTEGER
+    ,message      TEXT
+    ,updated_at   TEXT
+    ,PRIMARY KEY (airport_name, fcst_date)
+    )
+    '''
+
+
+def migration_add_backfill_checkpoints(db_conn):
+    db_conn.execute(backfill_ddl)
+
+
+# Error statistics: sums of squares and of absolute errors for the rollups,
+# the precipitation probability error for AvF, and histogram tables for
+# the quantiles (see error_stats.py)
+error_stats_columns = {
+    'weather_avf_compare' : ['prob_precip_delta REAL'],
+    'weather_avf_rollup'  : [
+        'sumabs_temp_delta REAL NOT NULL DEFAULT 0',
+        'sumabs_wind_speed_delta REAL NOT NULL DEFAULT 0',
+        'sum_prob_precip_delta REAL NOT NULL DEFAULT 0',
+        'sumsq_prob_precip_delta REAL NOT NULL DEFAULT 0',
+        'sumabs_prob_precip_delta REAL NOT NULL DEFAULT 0',
+        'cnt_prob_precip_delta INTEGER NOT NULL DEFAULT 0',
+    ],
+    'weather_fvf_rollup'  : [
+        'sumsq_temp_delta REAL NOT NULL DEFAULT 0',
+        'sumabs_temp_delta REAL NOT NULL DEFAULT 0',
+        'sumsq_prob_precip_delta REAL NOT NULL DEFAULT 0',
+        'sumabs_prob_precip_delta REAL NOT NULL DEFAULT 0',
+        'sumsq_wind_speed_delta REAL NOT NULL DEFAULT 0',
+        'sumabs_wind_speed_delta REAL NOT NULL DEFAULT 0',
+    ],
+}
+
+error_hist_ddl = [
+    '''
+    CREATE TABLE IF NOT EXISTS weather_avf_hist (
+     airport_name TEXT    NOT NULL
+    ,interp_day   INTEGER NOT NULL
+    ,interp_hour  INTEGER NOT NULL
+    ,metric       TEXT    NOT NULL
+    ,bin          INTEGER NOT NULL
+    ,cnt          INTEGER NOT NULL DEFAULT 0
+    ,PRIMARY KEY (airport_name, interp_day, interp_hour, metric, bin)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS weather_fvf_hist (
+     airport_name TEXT    NOT NULL
+    ,day_of_snp1  INTEGER NOT NULL
+    ,day_of_snp2  INTEGER NOT NULL
+    ,fcst_hour    INTEGER NOT NULL
+    ,metric       TEXT    NOT NULL
+    ,bin          INTEGER NOT NULL
+    ,cnt          INTEGER NOT NULL DEFAULT 0
+    ,PRIMARY KEY (airport_name, day_of_snp1, day_of_snp2, fcst_hour, metric, bin)
+    ) WITHOUT ROWID
+    ''',
+]
+
+def migration_add_error_stats(db_conn):
+    for table_name, columns in error_stats_columns.items():
+        for column in columns:
+            db_conn.execute('ALTER TABLE {0} ADD COLUMN {1}'.format(table_name, column))
+
+    for ddl in error_hist_ddl:
+        db_conn.execute(ddl)
+
+    # prob_precip_delta is left NULL for history: compare rows written
+    # before the interpolation fix hold the wind speed in fcst_precip_prob.
+    # backfill_avf.py --recompute-precip recomputes those dates.
+
+    # The new sums and histograms need the full history
+    return True
+
+
+def migration_add_backfill_run_id(db_conn):
+    # Recompute runs of backfill_avf.py checkpoint under their own run id,
+    # so a resumed run skips only what that run has already redone
+    db_conn.execute('ALTER TABLE weather_avf_backfill ADD COLUMN run_id TEXT')
+
+
+# Applied in order. The schema version (PRAGMA user_version) is the number
+# of migrations applied. Only ever append to this list. A migration returns
+# True if the rollups must be rebuilt afterwards.
+migrations = [
+    migration_create_tables,
+    migration_create_indexes,
+    migration_rebuild_rollups,
+    migration_add_time_columns,
+    migration_add_backfill_checkpoints,
+    migration_add_error_stats,
+    migration_add_backfill_run_id,
+]
+
+schema_version = len(migrations)
+
+
+def get_schema_version(db_conn):
+    cur = db_conn.cursor()
+    cur.execute('PRAGMA user_version')
+    return cur.fetchone()[0]
+
+
+def migrate(db_conn):
+    # Bring the database up to the current schema version in place
+    version = get_schema_version(db_conn)
+    rebuild_rollups = False
+
+    for new_version in range(version + 1, schema_version + 1):
+        print('Migrating weather db to schema version {0}'.format(new_version))
+        if migrations[new_version - 1](db_conn):
+            rebuild_rollups = True
+        db_conn.execute('PRAGMA user_version = {0}'.format(new_version))
+        db_conn.commit()
+
+    # Rebuilt once, against the final schema
+    if rebuild_rollups:
+        from rollups import rebuild_fvf_rollup, rebuild_avf_rollup
+        rebuild_fvf_rollup(db_conn)
+        rebuild_avf_rollup(db_conn)
+
+
+if __name__ == '__main__':
+    # Upgrade the weather db in place
+    from db_connections import get_write_connection
+    db_conn = get_write_connection()
+    print('Weather db is at schema version {0}'.format(get_schema_version(db_conn)))
@@ -0,0 +1,77 @@
+import numpy as np
+from itertools import groupby
+
+from response_formats import time_str_to_epoch
+
+
+def lttb_indices(x, y, n_out):
+    # Largest-triangle-three-buckets. Keeps the first and last points and,
+    # from each of the n_out - 2 buckets in between, the point forming the
+    # largest triangle with the previously kept point and the average of
+    # the next bucket. Returns the indices of the kept points.
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype = np.float64)
+    y = np.asarray(y, dtype = np.float64)
+
+    # Bucket boundaries for the interior points
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+
+    kept = np.empty(n_out, dtype = np.int64)
+    kept[0]  = 0
+    kept[-1] = n - 1
+
+    prev = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+
+        # Average of the next bucket (the last point for the final bucket)
+        if i + 2 < len(edges):
+            next_lo, next_hi = edges[i + 1], edges[i + 2]
+        else:
+            next_lo, next_hi = n - 1, n
+        x_avg = x[next_lo:next_hi].mean()
+        y_next = y[next_lo:next_hi]
+        y_avg = np.nanmean(y_next) if np.any(~np.isnan(y_next)) else np.nan
+
+        # Triangle areas for every point in the bucket at once
+        area = np.abs(
+            (x[prev] - x_avg) * (y[lo:hi] - y[prev]) -
+            (x[prev] - x[lo:hi]) * (y_avg - y[prev])
+        )
+
+        # Missing values are only kept if the whole bucket is missing
+        area = np.where(np.isnan(area), -1.0, area)
+
+        prev = lo + int(np.argmax(area))
+        kept[i + 1] = prev
+
+    return kept
+
+
+def downsample_rows(columns, rows, max_points, x_col, y_col, group_col = None):
+    # Downsample each series (consecutive rows sharing group_col) to at most
+    # max_points rows, choosing points by x_col (a time stamp) and y_col
+    x_idx = columns.index(x_col)
+    y_idx = columns.index(y_col)
+
+    if group_col is None:
+        groups = [rows]
+    else:
+        g_idx  = columns.index(group_col)
+        groups = [list(g) for _, g in groupby(rows, key = lambda row: row[g_idx])]
+
+    result = []
+    for group in groups:
+        if len(group) <= max_points:
+            result.extend(group)
+            continue
+
+        x = np.array([time_str_to_epoch(row[x_idx]) for row in group], dtype = np.float64)
+        y = np.array([row[y_idx] for row in group], dtype = np.float64)
+
+        result.extend(group[i] for i in lttb_indices(x, y, max_points))
+
+    return result
@@ -0,0 +1,216 @@
+# Forecast error statistics kept per heatmap cell as mergeable partial
+# sums: sum, sum of squares, sum of absolute values and count for the
+# mean, RMSE and MAE, plus a fixed-bin histogram for approximate
+# quantiles. Partial sums and histograms for several ingests, or several
+# airports, combine by adding them up.
+#
+# numpy and pandas are only imported by the functions reading statistics,
+# so the web app and the rollup SQL can use this module without them.
+
+# metric : (low edge, high edge, bin width). Errors outside the range are
+# counted in the first or last bin, so quantiles in the tails are clamped
+# to the range.
+error_bins = {
+    'temp_delta'        : (-30.0, 30.0, 1.0),
+    'wind_speed_delta'  : (-30.0, 30.0, 1.0),
+    'prob_precip_delta' : (-100.0, 100.0, 5.0),
+}
+
+# Metrics kept for each comparison
+avf_error_metrics = ['temp_delta', 'wind_speed_delta', 'prob_precip_delta']
+fvf_error_metrics = ['temp_delta', 'prob_precip_delta', 'wind_speed_delta']
+
+# Channels along the last axis of the fvf heatmap cube
+# (forecast_tools.get_fvf_heatmap_cube)
+fvf_cube_channels = ['temp_delta', 'wind_speed_delta', 'prob_precip_delta', 'cnt_snp2_v_snp1']
+
+# Statistics available per cell
+error_stat_names = ['bias', 'rmse', 'mae', 'count', 'p10', 'p50', 'p90']
+
+
+def stat_quantiles(stat):
+    # Quantiles needed for a statistic, e.g. (0.9,) for 'p90'
+    if stat not in error_stat_names:
+        raise ValueError('Unknown heatmap statistic: {0}'.format(stat))
+    return (int(stat[1:]) / 100.0,) if stat.startswith('p') else ()
+
+
+def n_bins(metric):
+    lo, hi, width = error_bins[metric]
+    return int(round((hi - lo) / width))
+
+
+def hist_bin_sql(expr, metric):
+    # SQL for the histogram bin of a non-NULL value, clamped to the range
+    lo, hi, width = error_bins[metric]
+    return 'cast((max({lo!r}, min({expr}, {top!r})) - {lo!r}) / {width!r} as integer)'.format(
+        expr = expr, lo = lo, top = hi - width / 2, width = width
+    )
+
+
+def rollup_sums_sql(metric):
+    # Select list of the partial sums for a metric, in rollup column order
+    return ('total({0}), total({0} * {0}), total(abs({0})), count({0})'
+            .format(metric))
+
+
+def rollup_sum_columns(metric):
+    return ['sum_' + metric, 'sumsq_' + metric, 'sumabs_' + metric, 'cnt_' + metric]
+
+
+def sums_rollup_query(rollup_table, key_columns, metrics, count_column = None):
+    # Upsert the partial sums for rows of the cells table. count_column, if
+    # given, counts every row.
+    keys = ', '.join(key_columns)
+    sum_columns = [c for m in metrics for c in rollup_sum_columns(m)]
+    select_sums = [rollup_sums_sql(m) for m in metrics]
+    if count_column is not None:
+        sum_columns.append(count_column)
+        select_sums.append('count(*)')
+
+    return '''
+    INSERT INTO {rollup_table} ({keys}, {sum_columns})
+    SELECT {keys}, {select_sums}
+    FROM cells
+    GROUP BY {keys}
+    ON CONFLICT ({keys}) DO UPDATE SET
+    {updates}
+    '''.format(
+        rollup_table = rollup_table,
+        keys = keys,
+        sum_columns = ', '.join(sum_columns),
+        select_sums = ', '.join(select_sums),
+        updates = '\n    ,'.join('{0} = {0} + excluded.{0}'.format(s) for s in sum_columns)
+    )
+
+
+def hist_rollup_query(hist_table, key_columns, metrics):
+    # Upsert the histogram counts for rows of the cells table. Each metric
+    # is binned in its own branch.
+    keys = ', '.join(key_columns)
+    branches = '\n        UNION ALL\n'.join(
+        '''
+        SELECT {keys}, '{metric}' as metric, {bin_sql} as bin
+        FROM cells
+        WHERE {metric} IS NOT NULL'''.format(
+            keys = keys, metric = m, bin_sql = hist_bin_sql(m, m)
+        )
+        for m in metrics
+    )
+
+    return '''
+    INSERT INTO {hist_table} ({keys}, metric, bin, cnt)
+    SELECT {keys}, metric, bin, count(*)
+    FROM ({branches}
+    )
+    GROUP BY {keys}, metric, bin
+    ON CONFLICT ({keys}, metric, bin) DO UPDATE SET
+     cnt = cnt + excluded.cnt
+    '''.format(hist_table = hist_table, keys = keys, branches = branches)
+
+
+def hist_quantiles(counts, metric, quantiles):
+    # Approximate quantiles from histogram counts shaped (cells, bins),
+    # interpolating linearly within the bin. NaN for empty cells.
+    import numpy as np
+
+    lo, hi, width = error_bins[metric]
+    counts = np.asarray(counts, dtype = np.float64)
+    cum_counts = np.cumsum(counts, axis = 1)
+    total = cum_counts[:, -1]
+
+    values = np.full((len(counts), len(quantiles)), np.nan)
+    cells = np.nonzero(total > 0)[0]
+    for j, q in enumerate(quantiles):
+        target = q * total[cells]
+        # First bin whose cumulative count reaches the target
+        bins = (cum_counts[cells] < target[:, None]).sum(axis = 1)
+        bins = np.minimum(bins, counts.shape[1] - 1)
+        below = np.where(bins > 0, cum_counts[cells, np.maximum(bins - 1, 0)], 0.0)
+        in_bin = counts[cells, bins]
+        frac = np.where(in_bin > 0, (target - below) / np.where(in_bin > 0, in_bin, 1.0), 0.0)
+        values[cells, j] = lo + (bins + np.clip(frac, 0.0, 1.0)) * width
+
+    return values
+
+
+def airport_filter_sql(airport_names):
+    # WHERE condition and parameters for one airport or a list of them
+    if isinstance(airport_names, str):
+        airport_names = [airport_names]
+    airport_names = list(airport_names)
+
+    return ('airport_name IN ({0})'.format(','.join('?' * len(airport_names))),
+            tuple(airport_names))
+
+
+def read_cell_error_stats(db_conn, rollup_table, hist_table, key_columns,
+                          metrics, airport_names, quantiles = (0.1, 0.5, 0.9),
+                          extra_columns = ()):
+    # Per-cell statistics for the airports, merged by summing their partial
+    # sums and histograms. Columns are <stat>_<metric>, with stat one of
+    # bias, rmse, mae, count and p<nn> for each quantile.
+    import numpy as np
+    import pandas as pd
+
+    keys = ', '.join(key_columns)
+    airport_sql, airport_params = airport_filter_sql(airport_names)
+    sum_columns = [c for m in metrics for c in rollup_sum_columns(m)] + list(extra_columns)
+
+    c = db_conn.cursor()
+    c.execute(
+        '''
+        SELECT {keys}, {sums}
+        FROM {rollup_table}
+        WHERE {airport_sql}
+        GROUP BY {keys}
+        ORDER BY {keys}
+        '''.format(
+            keys = keys,
+            sums = ', '.join('total({0}) as {0}'.format(s) for s in sum_columns),
+            rollup_table = rollup_table,
+            airport_sql = airport_sql
+        ),
+        airport_params
+    )
+    df_sums = pd.DataFrame(c.fetchall(), columns = [d[0] for d in c.description])
+
+    df_stats = df_sums[list(key_columns)].copy()
+    for m in metrics:
+        cnt = df_sums['cnt_' + m].where(df_sums['cnt_' + m] > 0)
+        df_stats['bias_' + m]  = df_sums['sum_' + m] / cnt
+        df_stats['rmse_' + m]  = np.sqrt(df_sums['sumsq_' + m] / cnt)
+        df_stats['mae_' + m]   = df_sums['sumabs_' + m] / cnt
+        df_stats['count_' + m] = df_sums['cnt_' + m].astype(np.int64)
+    for s in extra_columns:
+        df_stats[s] = df_sums[s].astype(np.int64)
+
+    if len(quantiles) == 0 or len(df_stats) == 0:
+        return df_stats
+
+    # Histograms, placed in a dense (cell, bin) array per metric
+    c.execute(
+        '''
+        SELECT {keys}, metric, bin, sum(cnt)
+        FROM {hist_table}
+        WHERE {airport_sql}
+        GROUP BY {keys}, metric, bin
+        '''.format(keys = keys, hist_table = hist_table, airport_sql = airport_sql),
+        airport_params
+    )
+    df_hist = pd.DataFrame(c.fetchall(), columns = list(key_columns) + ['metric', 'bin', 'cnt'])
+
+    cell_index = pd.MultiIndex.from_frame(df_stats[list(key_columns)])
+    for m in metrics:
+        df_m = df_hist[df_hist['metric'] == m]
+        counts = np.zeros((len(df_stats), n_bins(m)))
+        rows = cell_index.get_indexer(pd.MultiIndex.from_frame(df_m[list(key_columns)]))
+        keep = rows >= 0
+        np.add.at(counts, (rows[keep], df_m['bin'].to_numpy()[keep]), df_m['cnt'].to_numpy()[keep])
+
+        values = hist_quantiles(counts, m, quantiles)
+        for j, q in enumerate(quantiles):
+            df_stats['p{0:02d}_{1}'.format(int(round(100 * q)), m)] = values[:, j]
+
+    return df_stats
+
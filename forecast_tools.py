@@ -1,19 +1,43 @@
 import os
-import sqlite3
-from scipy.interpolate import interp1d
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 from pytz import timezone
 
-from db_setup import weather_db_loc, airport_list_loc
+from db_connections import get_read_connection
+from airport_catalog import get_airport_catalog
+from time_columns import local_date_to_utc_epoch
+from loader_memo import memoized_loader
+from error_stats import (read_cell_error_stats, stat_quantiles,
+                         avf_error_metrics, fvf_error_metrics, fvf_cube_channels)
 
 UTC = timezone('UTC')
 
+# Local date windows selected by the loaders' arguments, None for all dates
+def fcst_date_window(date_str = None, date_range_strs = None):
+    if date_str is not None:
+        date_time = datetime.strptime(date_str, '%Y-%m-%d')
+        return ((date_time + timedelta(days = 0)).strftime('%Y-%m-%d'),
+                (date_time + timedelta(days = 2)).strftime('%Y-%m-%d'))
+    elif date_range_strs is not None:
+        return (date_range_strs[0], date_range_strs[1])
+    else:
+        return None
+
+def actl_date_window(date_str = None):
+    if date_str is not None:
+        date_time = datetime.strptime(date_str, '%Y-%m-%d')
+        return ((date_time + timedelta(days = 0)).strftime('%Y-%m-%d'),
+                (date_time + timedelta(days = 1)).strftime('%Y-%m-%d'))
+    else:
+        return None
+
+
 # Get the original forecast
+@memoized_loader(fcst_date_window)
 def get_fcst(airport_name, date_str = None, date_range_strs = None):
     # Connection to the database
-    db = sqlite3.connect(weather_db_loc)
+    db = get_read_connection()
     c  = db.cursor()
 
     # Pull all dates
@@ -30,24 +54,23 @@ def get_fcst(airport_name, date_str = None, date_range_strs = None):
             ,temperature_hourly
             FROM weather_fcst
             WHERE airport_name = ?
-            ORDER BY pull_date, forecast_time_stamps
+            ORDER BY pull_date, forecast_utc_epoch
             ''',
             query_params
         )
 
     # Pull a single date
     else:
-        if date_str is not None:
-            # date range to pull
-            date_time = datetime.strptime(date_str, '%Y-%m-%d')
-            first_pull_dt = (date_time + timedelta(days = 0)).strftime('%Y-%m-%d')
-            last_pull_dt =  (date_time + timedelta(days = 2)).strftime('%Y-%m-%d')
-        else:
-            first_pull_dt = date_range_strs[0]
-            last_pull_dt  = date_range_strs[1]
+        # date range to pull
+        first_pull_dt, last_pull_dt = fcst_date_window(date_str, date_range_strs)
         
+        # Local dates to a UTC epoch range
+        tz_str = get_airport_catalog().time_zone(airport_name)
+
         # Forecast query
-        query_params = (airport_name, first_pull_dt, last_pull_dt)        
+        query_params = (airport_name,
+                        local_date_to_utc_epoch(first_pull_dt, tz_str),
+                        local_date_to_utc_epoch(last_pull_dt, tz_str))
         query = c.execute(        
             '''
             SELECT 
@@ -58,9 +81,9 @@ def get_fcst(airport_name, date_str = None, date_range_strs = None):
             ,temperature_hourly
             FROM weather_fcst
             WHERE airport_name = ?
-              AND ? <= forecast_time_stamps
-              AND forecast_time_stamps < ?
-            ORDER BY pull_date, forecast_time_stamps
+              AND ? <= forecast_utc_epoch
+              AND forecast_utc_epoch < ?
+            ORDER BY pull_date, forecast_utc_epoch
             ''',
             query_params
         )
@@ -79,9 +102,10 @@ def get_fcst(airport_name, date_str = None, date_range_strs = None):
 
 
 # Get the actual values
+@memoized_loader(actl_date_window)
 def get_actl(airport_name, date_str = None):
     # Connection to the database
-    db = sqlite3.connect(weather_db_loc)
+    db = get_read_connection()
     c  = db.cursor()
 
     if date_str is None:
@@ -97,17 +121,20 @@ def get_actl(airport_name, date_str = None):
             ,air_temp
             FROM weather_actl 
             WHERE airport_name = ?
-            ORDER BY datetime
+            ORDER BY datetime_utc_epoch
             ''',
             query_params
         )
     else:
         # date range to pull
-        date_time = datetime.strptime(date_str, '%Y-%m-%d')
-        first_pull_dt = (date_time + timedelta(days = 0)).strftime('%Y-%m-%d')
-        last_pull_dt =  (date_time + timedelta(days = 1)).strftime('%Y-%m-%d')
+        first_pull_dt, last_pull_dt = actl_date_window(date_str)
+
+        # Local dates to a UTC epoch range
+        tz_str = get_airport_catalog().time_zone(airport_name)
         
-        query_params = (airport_name, first_pull_dt, last_pull_dt)
+        query_params = (airport_name,
+                        local_date_to_utc_epoch(first_pull_dt, tz_str),
+                        local_date_to_utc_epoch(last_pull_dt, tz_str))
         query = c.execute(        
             '''
             SELECT 
@@ -118,9 +145,9 @@ def get_actl(airport_name, date_str = None):
             ,air_temp
             FROM weather_actl 
             WHERE airport_name = ?
-              AND datetime >= ?
-              AND datetime <  ? 
-            ORDER BY datetime
+              AND datetime_utc_epoch >= ?
+              AND datetime_utc_epoch <  ?
+            ORDER BY datetime_utc_epoch
             ''',
             query_params
         )
@@ -138,9 +165,10 @@ def get_actl(airport_name, date_str = None):
 
 
 # Get the actual values
+@memoized_loader(lambda: None)
 def get_actl_times(airport_name):
     # Connection to the database
-    db = sqlite3.connect(weather_db_loc)
+    db = get_read_connection()
     c  = db.cursor()
 
     # Actual query
@@ -151,7 +179,7 @@ def get_actl_times(airport_name):
              datetime
             FROM weather_actl 
             WHERE airport_name = ?
-            ORDER BY datetime
+            ORDER BY datetime_utc_epoch
         ''',
         query_params
     )
@@ -167,97 +195,111 @@ def get_actl_times(airport_name):
     return df_actl_times
 
 
+# Columns of the interpolated forecast
+fcst_interp_columns = ['pull_date', 'datetime', 'interp_seconds', 'interp_day', 'interp_hour',
+                       'fcst_temperature', 'fcst_wind_speed', 'fcst_precip_prob']
+
+# Interpolated column : forecast column
+fcst_interp_values = {
+    'fcst_temperature' : 'temperature_hourly',
+    'fcst_wind_speed'  : 'wind_speed_sustained',
+    'fcst_precip_prob' : 'probability_of_precipitation_floating',
+}
+
+
+def get_utc_and_local_seconds(times):
+    # UTC epoch seconds, and the local wall clock time in seconds, for
+    # tz-aware time stamps which may carry different UTC offsets
+    utc_seconds = pd.to_datetime(times, utc = True).values.astype('datetime64[s]').astype(np.int64)
+    local_seconds = pd.to_datetime(times.astype(str).str.slice(0, 19)).values.astype('datetime64[s]').astype(np.int64)
+
+    return utc_seconds, local_seconds
+
+
 def get_fcst_interp(airport_name, date_str = None):
     df_actl_times = get_actl(airport_name, date_str)
     df_fcst = get_fcst(airport_name, date_str = date_str)
 
-    # All of the unique actual times and forecast pull_dts
+    # All of the unique actual times
     all_actl_tms = pd.Series(df_actl_times.datetime.unique())
-    all_pull_dts = pd.Series(df_fcst.pull_date.unique())
-    
-    all_interp_dfs = []
-    
-    for pull_dt in all_pull_dts:
-        # Data frame for the current pull date
-        df_curr_fcst = df_fcst.loc[df_fcst['pull_date'] == pull_dt, df_fcst.columns]
-        df_curr_fcst.reindex()
-
-        # must have at least 2 datapoints to interpolate
-        try:
-            nt_f, _ = df_curr_fcst.shape
-            nt_a, _ = df_actl_times.shape
-        except:
-            nt_f = 0
-            nt_a = 0
-        
-        if nt_f >= 2 and nt_a > 0:        
-            # Interpolation range
-            t_min = df_curr_fcst['forecast_time_stamps'].min()
-            t_min_orig_tzinfo = t_min.tzinfo
-            t_min = t_min.astimezone(UTC)
-            t_max = df_curr_fcst['forecast_time_stamps'].max().astimezone(UTC)
-
-            # First applicable date of forecast
-            t_fcst_min = datetime.strptime(pull_dt, '%Y-%m-%d').replace(tzinfo = t_min_orig_tzinfo).astimezone(UTC)
-
-            df_curr_fcst['seconds_since_min'] = (df_curr_fcst['forecast_time_stamps'].apply(lambda t: t.astimezone(UTC)) - t_fcst_min)
-            df_curr_fcst['seconds_since_min'] = df_curr_fcst['seconds_since_min'].apply(lambda t: t.total_seconds())
-            
-            # Actual times in seconds to interpolate at
-            df_interp = pd.DataFrame({'datetime' : all_actl_tms})
-            df_interp['t_fcst_min'] = t_fcst_min
-            df_interp['time_delta'] = (df_interp['datetime'].apply(lambda t: t.astimezone(UTC)) - t_fcst_min)
-            df_interp['interp_seconds'] = df_interp['time_delta'].apply(lambda x: x.total_seconds())
-            df_interp['interp_day'    ] = df_interp['time_delta'].apply(lambda x: x.days)#/ (3600 * 24)
-            df_interp['interp_hour'   ] = df_interp['datetime'  ].apply(lambda x: x.hour)
-            df_interp = df_interp[(df_interp['datetime'].apply(lambda t: t.astimezone(UTC)) >= t_min) &
-                                  (df_interp['datetime'].apply(lambda t: t.astimezone(UTC)) <= t_max)]
-            df_interp.reindex()
-            df_interp['pull_date'] = pull_dt
-            
-            # Interpolate temperature
-            cs_temperature = interp1d(
-                df_curr_fcst['seconds_since_min'], 
-                df_curr_fcst['temperature_hourly'],
-                fill_value="extrapolate"
-            )
-            df_interp['fcst_temperature'] = cs_temperature(df_interp['interp_seconds'])
-            
-            # Interpolate sustained wind speed
-            cs_wind_speed = interp1d(
-                df_curr_fcst['seconds_since_min'], 
-                df_curr_fcst['wind_speed_sustained'],
-                fill_value="extrapolate"
-            )
-            df_interp['fcst_wind_speed'] = cs_wind_speed(df_interp['interp_seconds'])
-            
-            # Interpolate probability of precipitation
-            cs_precip = interp1d(
-                df_curr_fcst['seconds_since_min'], 
-                df_curr_fcst['probability_of_precipitation_floating'],
-                fill_value="extrapolate"
-            )
-            df_interp['fcst_precip_prob'] = cs_wind_speed(df_interp['interp_seconds'])
-            
-            # Re-arrange
-            df_interp = df_interp[['pull_date', 'datetime', 'interp_seconds', 'interp_day', 'interp_hour',
-                                  'fcst_temperature', 'fcst_wind_speed', 'fcst_precip_prob']]
-            
-            all_interp_dfs.append(df_interp)
-
-    # Append all together
-    if all_interp_dfs:
-        df_interp_all = pd.concat(all_interp_dfs)
-    else:
-        df_interp_all = pd.DataFrame({
-            'pull_date' : [],  'datetime' : [],
-            'interp_seconds' : [], 'interp_day' : [],
-            'interp_hour' : [],  'fcst_temperature' : [],
-            'fcst_wind_speed' : [], 'fcst_precip_prob':[]
-        })
-        df_interp_all['datetime'] = pd.to_datetime(df_interp_all['datetime'])
 
-    return df_interp_all
+    # Nothing to interpolate
+    if len(all_actl_tms) == 0 or len(df_fcst) < 2:
+        df_interp_all = pd.DataFrame({c : [] for c in fcst_interp_columns})
+        df_interp_all['datetime'] = pd.to_datetime(df_interp_all['datetime'])
+        return df_interp_all
+
+    # Actual times as integers, sorted by UTC time
+    actl_utc, actl_local = get_utc_and_local_seconds(all_actl_tms)
+    actl_order = np.argsort(actl_utc, kind = 'stable')
+    all_actl_tms = all_actl_tms.iloc[actl_order].reset_index(drop = True)
+    actl_utc   = actl_utc[actl_order]
+    actl_local = actl_local[actl_order]
+
+    # Forecast times as integers, sorted by (pull date, UTC time)
+    fcst_utc, fcst_local = get_utc_and_local_seconds(df_fcst['forecast_time_stamps'])
+    pull_codes, all_pull_dts = pd.factorize(df_fcst['pull_date'], sort = True)
+    fcst_order = np.lexsort((fcst_utc, pull_codes))
+    pull_codes  = pull_codes[fcst_order]
+    fcst_utc    = fcst_utc[fcst_order]
+    fcst_offset = (fcst_local - fcst_utc)[fcst_order]
+    fcst_values = {
+        k : df_fcst[v].to_numpy(dtype = np.float64)[fcst_order]
+        for k, v in fcst_interp_values.items()
+    }
+
+    # Each pull date is a contiguous block. Must have at least 2 datapoints
+    # to interpolate.
+    all_codes = np.arange(len(all_pull_dts))
+    starts = np.searchsorted(pull_codes, all_codes, side = 'left')
+    ends   = np.searchsorted(pull_codes, all_codes, side = 'right')
+    groups = all_codes[ends - starts >= 2]
+    starts, ends = starts[groups], ends[groups]
+
+    # First applicable time of each forecast: midnight on the pull date, in
+    # the UTC offset of its earliest time stamp
+    pull_midnight = pd.to_datetime(pd.Series(all_pull_dts[groups])).values.astype('datetime64[s]').astype(np.int64)
+    t_fcst_min = pull_midnight - fcst_offset[starts]
+
+    # Actual times within each forecast's range are a contiguous slice of
+    # the sorted actual times. Expand to (pull date, actual time) pairs.
+    actl_lo = np.searchsorted(actl_utc, fcst_utc[starts], side = 'left')
+    actl_hi = np.searchsorted(actl_utc, fcst_utc[ends - 1], side = 'right')
+    n_pairs = actl_hi - actl_lo
+
+    pair_group = np.repeat(np.arange(len(groups)), n_pairs)
+    pair_first = np.cumsum(n_pairs) - n_pairs
+    pair_actl  = np.arange(n_pairs.sum()) - np.repeat(pair_first - actl_lo, n_pairs)
+    t = actl_utc[pair_actl]
+
+    # Bracketing forecast points for every pair at once, searching a key
+    # that orders by (pull date, time)
+    t0   = fcst_utc.min()
+    span = fcst_utc.max() - t0 + 1
+    fcst_key = pull_codes * span + (fcst_utc - t0)
+    pair_key = groups[pair_group] * span + (t - t0)
+    right = np.searchsorted(fcst_key, pair_key, side = 'right')
+    left  = np.clip(right - 1, starts[pair_group], ends[pair_group] - 2)
+    right = left + 1
+
+    # Linear interpolation weights
+    dt = (fcst_utc[right] - fcst_utc[left]).astype(np.float64)
+    w  = np.divide((t - fcst_utc[left]).astype(np.float64), dt,
+                   out = np.zeros(len(t)), where = dt > 0)
+
+    # Assemble
+    time_delta = t - t_fcst_min[pair_group]
+    df_interp_all = pd.DataFrame({
+        'pull_date'      : all_pull_dts[groups][pair_group],
+        'datetime'       : all_actl_tms.iloc[pair_actl].reset_index(drop = True),
+        'interp_seconds' : time_delta.astype(np.float64),
+        'interp_day'     : np.floor_divide(time_delta, 24 * 3600),
+        'interp_hour'    : (actl_local[pair_actl] // 3600) % 24,
+    })
+    for k, y in fcst_values.items():
+        df_interp_all[k] = y[left] + w * (y[right] - y[left])
+
+    return df_interp_all[fcst_interp_columns]
 
 
 def get_avf_compare(airport_name, date_str = None):
@@ -275,85 +317,104 @@ def get_avf_compare(airport_name, date_str = None):
     #df_compare
     df_interp_compare['temp_delta'] = df_interp_compare['fcst_temperature'] - df_interp_compare['air_temp']
     df_interp_compare['wind_speed_delta'] = df_interp_compare['fcst_wind_speed'] - df_interp_compare['wind_speed']
+
+    # Forecast probability against whether it rained in the hour, for the
+    # times matched to an observation. No reported precipitation means none.
+    observed = df_interp_compare['air_temp'].notna() | df_interp_compare['wind_speed'].notna()
+    rained = df_interp_compare['precip_1_hour'].fillna(0) > 0
+    df_interp_compare['prob_precip_delta'] = (
+        df_interp_compare['fcst_precip_prob'] - 100.0 * rained
+    ).where(observed)
     
     return df_interp_compare
     
-def get_avf_heatmaps(airport_name):
-    db = sqlite3.connect(weather_db_loc)
-    c  = db.cursor()
-    
-    query_params = (airport_name,)        
-    query = c.execute(        
-        '''
-        SELECT 
-        interp_day
-        ,interp_hour
-        ,avg(temp_delta) as avg_temp_delta
-        ,avg(wind_speed_delta) as avg_wind_speed_delta
-        FROM weather_avf_compare
-        WHERE airport_name = ?
-          AND interp_day >= 0
-        GROUP BY interp_day, interp_hour
-        ORDER BY interp_day, interp_hour
-        ''',
-        query_params
-    )
-    fcst_rows = query.fetchall()
-    fcst_columns = [desc[0] for desc in c.description]    
-    df_pivot_flat = pd.DataFrame(fcst_rows, columns = fcst_columns)
-
-    temp_avf_heatmap_tbl = df_pivot_flat.pivot(
-        index = 'interp_day',
-        columns = 'interp_hour',
-        values='avg_temp_delta'
+def get_avf_error_stats(airport_names, quantiles = (0.1, 0.5, 0.9)):
+    # Per (interp_day, interp_hour) error statistics for one airport or
+    # several merged together
+    df_stats = read_cell_error_stats(
+        get_read_connection(), 'weather_avf_rollup', 'weather_avf_hist',
+        ['interp_day', 'interp_hour'], avf_error_metrics, airport_names, quantiles
     )
-    
-    wind_avf_heatmap_tbl = df_pivot_flat.pivot(
-        index = 'interp_day',
-        columns = 'interp_hour',
-        values='avg_wind_speed_delta'
+    return df_stats[df_stats['interp_day'] >= 0].reset_index(drop = True)
+
+def get_avf_heatmaps(airport_name, stat = 'bias',
+                     metrics = ('temp_delta', 'wind_speed_delta')):
+    # One (interp_day x interp_hour) table of the statistic per metric.
+    # airport_name may be a list, whose partial sums are merged.
+    df_pivot_flat = get_avf_error_stats(airport_name, stat_quantiles(stat))
+
+    return tuple(
+        df_pivot_flat.pivot(
+            index = 'interp_day',
+            columns = 'interp_hour',
+            values = '{0}_{1}'.format(stat, m)
+        )
+        for m in metrics
     )
-    
-    return temp_avf_heatmap_tbl, wind_avf_heatmap_tbl
 
 
-def get_fvf_heatmap_tbl(airport_name):
-    db = sqlite3.connect(weather_db_loc)
-    c  = db.cursor()
-    
-    query_params = (airport_name,)        
-    query = c.execute(            
-        '''
-        select
-           cast(julianday(f1.forecast_time_stamps) - julianday(f1.pull_date || " 00:00:00-" || substr(f1.forecast_time_stamps, 21)) as integer) as day_of_snp1
-          ,cast(julianday(f2.forecast_time_stamps) - julianday(f2.pull_date || " 00:00:00-" || substr(f2.forecast_time_stamps, 21)) as integer) as day_of_snp2
-          ,cast(substr(f2.forecast_time_stamps, 12, 2) as int) as fcst_hour
-          ,avg(f2.temperature_hourly - f1.temperature_hourly) as avg_temp_delta
-          ,avg(f2.probability_of_precipitation_floating - f1.probability_of_precipitation_floating) as avg_prob_precip_delta
-          ,avg(f2.wind_speed_sustained - f1.wind_speed_sustained) as avg_wind_speed_delta
-          ,count(*) as cnt_snp2_v_snp1
-        from weather_fcst as f1
-        left join weather_fcst as f2
-        on f1.forecast_time_stamps = f2.forecast_time_stamps
-        and f1.airport_name = f2.airport_name
-        where f1.airport_name = ?
-        and f2.pull_date > f1.pull_date
-        group by day_of_snp1, day_of_snp2, fcst_hour
-        order by day_of_snp1, day_of_snp2, fcst_hour
-        ''',
-        query_params
+def get_fvf_error_stats(airport_names, quantiles = (0.1, 0.5, 0.9)):
+    # Per (day_of_snp1, day_of_snp2, fcst_hour) error statistics for one
+    # airport or several merged together
+    return read_cell_error_stats(
+        get_read_connection(), 'weather_fvf_rollup', 'weather_fvf_hist',
+        ['day_of_snp1', 'day_of_snp2', 'fcst_hour'], fvf_error_metrics,
+        airport_names, quantiles, extra_columns = ['cnt_snp2_v_snp1']
     )
-    fcst_rows = query.fetchall()
-    fcst_columns = [desc[0] for desc in c.description]    
-    df_pivot_flat = pd.DataFrame(fcst_rows, columns = fcst_columns)
+
+def get_fvf_heatmap_tbl(airport_name, stat = 'bias'):
+    # The avg_ columns hold the requested statistic. airport_name may be a
+    # list, whose partial sums are merged.
+    df_stats = get_fvf_error_stats(airport_name, stat_quantiles(stat))
+
+    df_pivot_flat = df_stats[['day_of_snp1', 'day_of_snp2', 'fcst_hour']].copy()
+    for m in fvf_error_metrics:
+        df_pivot_flat['avg_' + m] = df_stats['{0}_{1}'.format(stat, m)]
+    df_pivot_flat['cnt_snp2_v_snp1'] = df_stats['cnt_snp2_v_snp1']
 
     return df_pivot_flat
 
-def get_fvf_heatmap_csv(airport_name):
-    df_pivot_flat = get_fvf_heatmap_tbl(airport_name)
+def get_fvf_heatmap_csv(airport_name, stat = 'bias'):
+    df_pivot_flat = get_fvf_heatmap_tbl(airport_name, stat)
     
     return df_pivot_flat.to_csv(index=False)
 
+def get_fvf_heatmap_cube(airport_name, stat = 'bias'):
+    # Dense float32 cube indexed [day_of_snp2, day_of_snp1, fcst_hour, channel]
+    # with the channels in fvf_cube_channels. Missing cells are NaN (count
+    # 0). Returns the cube and a view of its count channel.
+    df_pivot_flat = get_fvf_heatmap_tbl(airport_name, stat)
+    df_pivot_flat = df_pivot_flat[(df_pivot_flat['day_of_snp1'] >= 0) &
+                                  (df_pivot_flat['day_of_snp2'] >= 0)]
+
+    day1 = df_pivot_flat['day_of_snp1'].to_numpy(dtype = np.int64)
+    day2 = df_pivot_flat['day_of_snp2'].to_numpy(dtype = np.int64)
+    hour = df_pivot_flat['fcst_hour'].to_numpy(dtype = np.int64)
+    n_day1 = int(day1.max()) + 1 if len(day1) > 0 else 0
+    n_day2 = int(day2.max()) + 1 if len(day2) > 0 else 0
+    n_channels = len(fvf_cube_channels)
+
+    cube = np.full((n_day2, n_day1, 24, n_channels), np.nan, dtype = np.float32)
+    cube[..., -1] = 0
+
+    # Scatter the rows into the flattened cube
+    cells = (day2 * n_day1 + day1) * 24 + hour
+    values = np.column_stack(
+        [df_pivot_flat['avg_' + m].to_numpy(dtype = np.float32) for m in fvf_cube_channels[:-1]] +
+        [df_pivot_flat['cnt_snp2_v_snp1'].to_numpy(dtype = np.float32)]
+    )
+    cube.reshape(-1, n_channels)[cells] = values
+
+    return cube, cube[..., -1]
+
+def save_fvf_heatmap_cube(path_or_file, cube):
+    np.save(path_or_file, cube, allow_pickle = False)
+
+def load_fvf_heatmap_cube(path, mmap_mode = 'r'):
+    # Memory mapped read-only by default, so nothing is copied
+    cube = np.load(path, mmap_mode = mmap_mode, allow_pickle = False)
+    return cube, cube[..., -1]
+
 def get_fvf_heatmap_array(airport_name):
     df_pivot_flat = get_fvf_heatmap_tbl(airport_name)
 
@@ -0,0 +1,232 @@
+import os
+import time
+import random
+import sqlite3
+import threading
+from urllib.parse import urlsplit
+
+import requests
+import requests.adapters
+
+from db_setup import weather_db_loc
+
+# Politeness limits for the NWS hosts: sustained requests per second and
+# the burst allowed on top. Hosts not listed get the default.
+default_rate_limit = (1.0, 2)
+host_rate_limits = {
+    'forecast.weather.gov' : (2.0, 4),
+    'w1.weather.gov'       : (2.0, 4),
+}
+
+# Seconds to wait for a connection and for the response
+request_timeout = (10, 60)
+
+
+class TokenBucket:
+    # Blocking token bucket shared by the threads fetching from one host
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        # Wait until a token is available and take it. Returns the seconds
+        # spent waiting.
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+
+                wait = (1 - self._tokens) / self.rate
+
+            time.sleep(wait)
+            waited += wait
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+def get_rate_limiter(url):
+    # The shared bucket for the url's host
+    host = urlsplit(url).hostname
+    with _buckets_lock:
+        bucket = _buckets.get(host)
+        if bucket is None:
+            rate, burst = host_rate_limits.get(host, default_rate_limit)
+            bucket = _buckets[host] = TokenBucket(rate, burst)
+
+    return bucket
+
+
+# Conditional GET validators and bodies from earlier pulls. Lives next to
+# the weather db.
+http_cache_loc = os.path.join(
+    os.path.dirname(weather_db_loc),
+    'weather_http_cache.sqlite'
+)
+
+# Retries across all of the requests of one run. Once spent, failures are
+# returned straight away, so an outage cannot stall the whole batch.
+default_retry_budget = 20
+
+# Backoff before retry n is uniform in [0, min(cap, base * 2 ** n)]
+backoff_base = 1.0
+backoff_cap  = 30.0
+
+# Statuses worth retrying
+retry_statuses = (429, 500, 502, 503, 504)
+
+
+class FetchResult:
+    # What a fetch returns. A 304 carries the body stored from the earlier
+    # pull, with from_cache set.
+
+    def __init__(self, url, status_code, text, from_cache = False):
+        self.url = url
+        self.status_code = status_code
+        self.text = text
+        self.from_cache = from_cache
+
+    @property
+    def ok(self):
+        return self.status_code in (200, 304)
+
+
+class FetchClient:
+    # Pooled keep-alive sessions (one per thread), conditional GETs against
+    # stored validators, exponential backoff with jitter and a retry budget
+    # shared by every request of the run.
+
+    def __init__(self, cache_loc = http_cache_loc, retry_budget = default_retry_budget,
+                 pool_maxsize = 16):
+        self.pool_maxsize = pool_maxsize
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.start_run(retry_budget)
+
+        self._cache_conn = sqlite3.connect(cache_loc, timeout = 10, check_same_thread = False)
+        self._cache_conn.execute('PRAGMA journal_mode = WAL')
+        self._cache_conn.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS http_cache (
+             url           TEXT PRIMARY KEY
+            ,etag          TEXT
+            ,last_modified TEXT
+            ,body          TEXT NOT NULL
+            ,fetched_at    REAL NOT NULL
+            )
+            '''
+        )
+        self._cache_conn.commit()
+
+    def start_run(self, retry_budget = default_retry_budget):
+        # Reset the shared retry budget
+        with self._lock:
+            self.retries_left = retry_budget
+
+    def _take_retry(self):
+        with self._lock:
+            if self.retries_left <= 0:
+                return False
+            self.retries_left -= 1
+            return True
+
+    @property
+    def session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize = self.pool_maxsize)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+        return session
+
+    def _get_cached(self, url):
+        with self._lock:
+            return self._cache_conn.execute(
+                'SELECT etag, last_modified, body FROM http_cache WHERE url = ?', (url,)
+            ).fetchone()
+
+    def _put_cached(self, url, response):
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        with self._lock:
+            if etag is None and last_modified is None:
+                self._cache_conn.execute('DELETE FROM http_cache WHERE url = ?', (url,))
+            else:
+                self._cache_conn.execute(
+                    '''
+                    INSERT OR REPLACE INTO http_cache (url, etag, last_modified, body, fetched_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    ''',
+                    (url, etag, last_modified, response.text, time.time())
+                )
+            self._cache_conn.commit()
+
+    def backoff(self, attempt, response = None):
+        # Seconds to wait before the next attempt. Honours Retry-After.
+        if response is not None:
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                return min(backoff_cap, float(retry_after))
+        return random.uniform(0, min(backoff_cap, backoff_base * 2 ** attempt))
+
+    def get(self, url, max_attempts = 5):
+        # FetchResult for the url, or None if every attempt failed
+        cached = self._get_cached(url)
+        headers = {}
+        if cached is not None:
+            etag, last_modified, _ = cached
+            if etag is not None:
+                headers['If-None-Match'] = etag
+            if last_modified is not None:
+                headers['If-Modified-Since'] = last_modified
+
+        for attempt in range(max_attempts):
+            print('Attempting to pull from {0}. Attempt {1}/{2}'.format(url, attempt + 1, max_attempts))
+            get_rate_limiter(url).acquire()
+
+            response = None
+            try:
+                response = self.session.get(url, headers = headers, timeout = request_timeout)
+            except requests.RequestException as e:
+                print('Request to {0} failed: {1!r}'.format(url, e))
+            else:
+                print('Requested from {0} with result {1}'.format(url, response.status_code))
+                if response.status_code == 304 and cached is not None:
+                    return FetchResult(url, 304, cached[2], from_cache = True)
+                if response.status_code == 200:
+                    self._put_cached(url, response)
+                    return FetchResult(url, 200, response.text)
+                if response.status_code not in retry_statuses:
+                    return FetchResult(url, response.status_code, response.text)
+
+            if attempt + 1 == max_attempts:
+                break
+            if not self._take_retry():
+                print('Retry budget spent. Giving up on {0}.'.format(url))
+                break
+            time.sleep(self.backoff(attempt, response))
+
+        return None
+
+
+_fetch_client = None
+_fetch_client_lock = threading.Lock()
+
+def get_fetch_client():
+    # Shared client for this process
+    global _fetch_client
+    with _fetch_client_lock:
+        if _fetch_client is None:
+            _fetch_client = FetchClient()
+    return _fetch_client
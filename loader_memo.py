@@ -0,0 +1,72 @@
+import threading
+import functools
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Frames loaded from the db, memoized for the length of one ingest batch or
+# one request. Outside of a loader_memo() block the loaders always query.
+_memo_state = threading.local()
+
+
+class LoaderMemo:
+    # Size bounded, least recently used store of loaded frames
+
+    def __init__(self, max_entries = 64):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._frames = OrderedDict()
+
+    def __len__(self):
+        return len(self._frames)
+
+    def get_or_load(self, key, load):
+        df = self._frames.get(key)
+        if df is not None:
+            self._frames.move_to_end(key)
+            self.hits += 1
+            return df
+
+        self.misses += 1
+        df = self._frames[key] = load()
+        while len(self._frames) > self.max_entries:
+            self._frames.popitem(last = False)
+
+        return df
+
+
+@contextmanager
+def loader_memo(max_entries = 64):
+    # Memoize the loaders for the duration of the block. Nested blocks share
+    # the outermost memo.
+    memo = getattr(_memo_state, 'memo', None)
+    if memo is not None:
+        yield memo
+        return
+
+    memo = _memo_state.memo = LoaderMemo(max_entries)
+    try:
+        yield memo
+    finally:
+        _memo_state.memo = None
+
+
+def memoized_loader(date_window):
+    # Decorates loader(airport_name, ...). date_window maps the remaining
+    # arguments to the window they select, so calls asking for the same
+    # slice share an entry however they spell it. Callers get a copy and are
+    # free to modify it.
+    def decorator(load):
+        @functools.wraps(load)
+        def wrapper(airport_name, *args, **kwargs):
+            memo = getattr(_memo_state, 'memo', None)
+            if memo is None:
+                return load(airport_name, *args, **kwargs)
+
+            key = (load.__name__, airport_name, date_window(*args, **kwargs))
+            df = memo.get_or_load(key, lambda: load(airport_name, *args, **kwargs))
+            return df.copy()
+
+        return wrapper
+
+    return decorator
@@ -1,15 +1,21 @@
-from db_setup import data_input_root, weather_db_loc, df_airports
+from db_setup import data_input_root
+from airport_catalog import get_airport_catalog
+from db_connections import get_write_connection
 from pull_weather import midnight_pull_and_save, midnight_pull_df, midnight_time_zone
 from datetime import datetime
 from tzlocal import get_localzone
 from update_weather_db import *
+from response_cache import bump_data_generation
 
 # What time is it now in our current timezone?
 local_now_datetime = datetime.now(get_localzone())
 print('Local now ({}) : {}'.format(get_localzone(), local_now_datetime))
 
+# Airport list
+airport_catalog = get_airport_catalog()
+
 # Update pull and save
-midnight_pull_and_save(df_airports, out_root = data_input_root)
+midnight_pull_and_save(airport_catalog, out_root = data_input_root)
 
 # Pull Date:
 tz_to_run, pull_date_str = midnight_time_zone()
@@ -22,10 +28,12 @@ else:
 
 if tz_to_run is not None:
     # Connect to database
-    db_conn = sqlite3.connect(weather_db_loc)
+    db_conn = get_write_connection()
     
     # Update databases
-    update_df, _ = midnight_pull_df(df_airports)
-    update_list  = update_df['icao_designation'].to_list()
-    update_all_db_from_disk(db_conn, data_input_root, df_airports,
-                            update_list, last_actl_date_str)
+    update_airports, _ = midnight_pull_df(airport_catalog)
+    update_list  = [a['icao_designation'] for a in update_airports]
+    update_all_db_from_disk(db_conn, data_input_root, update_list, last_actl_date_str)
+
+    # Invalidate cached heatmaps built from the previous data
+    bump_data_generation()
@@ -3,45 +3,41 @@ from datetime import datetime, timedelta
 import numpy as np
 import pandas as pd
 import time
-from bs4 import BeautifulSoup
+from html.parser import HTMLParser
 import xml.etree.ElementTree as ET
 from io import StringIO
 from pytz import timezone
 from tzlocal import get_localzone
-     
+from concurrent.futures import ThreadPoolExecutor
 
-def random_sleep(sleep_min = 3, sleep_max = 4):
-     sleep_time = sleep_min + (sleep_max - sleep_min) * np.random.rand()
-     print('Sleeping for {0:04f} seconds.'.format(sleep_time))
-     time.sleep(sleep_time)
+from http_fetch import get_fetch_client
+from raw_archive import get_raw_archive
 
-def repeat_request(url, n_retries = 5, sleep_min = 15, sleep_max = 20):
-     for i in range(n_retries):
-          print('Attempting to pull from {0}. Attempt {1}/{2}'.format(url, i+1, n_retries))
-          try:
-               req = requests.get(url)
-          except:
-               random_sleep(sleep_min, sleep_max)               
-          else:
-               print('Requested from {0} with result {1}'.format(url, req.status_code))               
-               if req.status_code == 200:
-                    print('Successful return. No more retries.')
-                    break
-               else:                    
-                    print('Unsuccessful return. Attempting again.')
-                    random_sleep(sleep_min, sleep_max)
-     else:
+# lxml parses the forecast XML faster when it is installed. Its fromstring
+# needs bytes when the document declares an encoding.
+try:
+     from lxml import etree as fcst_etree
+except ImportError:
+     fcst_etree = ET
+     
+
+def repeat_request(url, n_retries = 5):
+     # Pooled, rate limited and conditional GET with backoff (see
+     # http_fetch.FetchClient). None if every attempt failed.
+     req = get_fetch_client().get(url, max_attempts = n_retries)
+     if req is not None and not req.ok:
+          print('Unsuccessful return from {0}: {1}'.format(url, req.status_code))
           req = None
           
      return req
 
-def pull_nws_fcst(airport_name, df_airports):
+def pull_nws_fcst(airport_name, airport_catalog):
      # Get url from table of URLS     
-     airport_df_row = df_airports[df_airports['icao_designation'] == airport_name]
+     airport_row = airport_catalog.lookup(airport_name)
 
      # Download weather from NWS for given airport    
-     if len(airport_df_row) == 1:
-          url = airport_df_row['nws_fcst_url'].iloc[0]
+     if airport_row is not None:
+          url = airport_row['nws_fcst_url']
           req = repeat_request(url)          
      else:
           req = None
@@ -52,52 +48,63 @@ def pull_nws_fcst(airport_name, df_airports):
      else:
           return None
 
+def parse_fcst_time_stamps(time_strs):
+     # One vectorized conversion when every stamp has the same UTC offset,
+     # which is every day but the DST changes
+     if len(set(t[19:] for t in time_strs)) <= 1:
+          return pd.to_datetime(np.array(time_strs, dtype = object))
+     else:
+          return [pd.to_datetime(t) for t in time_strs]
+
 def parse_nws_fcst(req_text, pull_date_str):
-     # Parse result
-     tree = ET.ElementTree(ET.fromstring(req_text))
-     root = tree.getroot()
+     # Parse result. One C-level parse of the document, then only the first
+     # time-layout and the typed parameter blocks are visited.
+     if isinstance(req_text, str):
+          req_text = req_text.encode('utf-8')
+     root = fcst_etree.fromstring(req_text)
 
      # Data: time and parameters forecasted
      data   = root.find('data')
      params = data.find('parameters')
 
-     # Parse the time of forecast
-     FcstTimeStamp = [pd.to_datetime(ts.text) for
-                      ts in data.find('time-layout').findall('start-valid-time')]
+     # Parse the time of forecast in one go
+     time_strs = [ts.text for ts in data.find('time-layout').iterfind('start-valid-time')]
 
-     # Parse the parameters of forecast
+     # Parse the parameters of forecast. Missing (nil) values are NaN.
      all_series = dict()
-     all_series['forecast_time_stamps'] = FcstTimeStamp
+     all_series['pull_date'] = pull_date_str
+     all_series['forecast_time_stamps'] = parse_fcst_time_stamps(time_strs)
      
      for elem in params:
           if 'type' in elem.attrib:        
                series_type = (elem.tag + ' ' + elem.attrib['type']).replace(' ', '_').replace('-','_')        
-               series = [float(v.text) if v.text is not None else np.nan for v in elem.findall('value')]        
+               values = [v.text for v in elem.iterfind('value')]
+               series = np.full(len(values), np.nan)
+               has_value = np.fromiter((v is not None for v in values), dtype = bool, count = len(values))
+               series[has_value] = [v for v in values if v is not None]
                all_series[series_type] = series
      
-     # convert to pandas dataframe and write to file
+     # convert to pandas dataframe
      df = pd.DataFrame(all_series)
 
-     # Append pull date on CSV          
-     cols = df.columns.to_list()
-     df['pull_date'] = pull_date_str
-     df = df[['pull_date'] + cols]
-
      return df
 
-def pull_save_parse_nws_fcst(airport_name, df_airports, pull_date_str, out_dir = None):
+def pull_save_parse_nws_fcst(airport_name, airport_catalog, pull_date_str, out_dir = None,
+                             archive = None):
      # Get url from table of URLS     
-     airport_df_row = df_airports[df_airports['icao_designation'] == airport_name]
-     tz_str = airport_df_row['time_zone'].iloc[0]
+     airport_row = airport_catalog.lookup(airport_name)
+     tz_str = airport_row['time_zone']
 
      # Unparsed XML
-     req_text = pull_nws_fcst(airport_name, df_airports)
+     req_text = pull_nws_fcst(airport_name, airport_catalog)
 
      # Early exit on failure
      if req_text is None:
           return None
 
-     # Retain XML file
+     # Retain XML, in the raw archive if given
+     elif archive is not None:
+          archive.put(airport_name, 'fcst', pull_date_str, req_text)
      elif out_dir is not None:
           fcst_file_xml = os.path.join(out_dir, 'nws_fcst_{0}.xml'.format(pull_date_str))
           with open(fcst_file_xml, 'w') as f:
@@ -116,10 +123,10 @@ def pull_save_parse_nws_fcst(airport_name, df_airports, pull_date_str, out_dir =
 
      return df
           
-def pull_nws_actl(airport_name, df_airports):
+def pull_nws_actl(airport_name, airport_catalog):
      # Get url from table of URLS     
-     airport_df_row = df_airports[df_airports['icao_designation'] == airport_name]
-     tz_str = airport_df_row['time_zone'].iloc[0]
+     airport_row = airport_catalog.lookup(airport_name)
+     tz_str = airport_row['time_zone']
 
      # What time is it now?
      now_datetime    = datetime.now(get_localzone())
@@ -137,20 +144,80 @@ def pull_nws_actl(airport_name, df_airports):
      else:
           return None
 
+class ObsTableExtractor(HTMLParser):
+     # Pulls the header and cell text out of one table of the obhistory page
+     # (the table_index-th <table> in document order) and stops once that
+     # table is closed. Cell text is the text of everything inside the cell.
+
+     def __init__(self, table_index = 3):
+          super().__init__(convert_charrefs = True)
+          self.table_index = table_index
+          self.n_tables = 0
+          self.depth = 0
+          self.rows = []
+          self.header = []
+          self._row = None
+          self._cell = None
+          self._cell_is_th = False
+
+     def handle_starttag(self, tag, attrs):
+          if tag == 'table':
+               if self.depth > 0:
+                    self.depth += 1
+               elif self.n_tables == self.table_index:
+                    self.depth = 1
+               self.n_tables += 1
+          elif self.depth == 0:
+               return
+          elif tag == 'tr':
+               self._row = []
+               self.rows.append(self._row)
+          elif tag in ('td', 'th'):
+               self._cell = []
+               self._cell_is_th = tag == 'th'
+
+     def handle_endtag(self, tag):
+          if self.depth == 0:
+               return
+          elif tag == 'table':
+               self.depth -= 1
+               if self.depth == 0:
+                    raise StopIteration
+          elif tag in ('td', 'th') and self._cell is not None:
+               if self._cell_is_th:
+                    self.header.append(self._cell)
+               elif self._row is not None:
+                    self._row.append(''.join(self._cell))
+               self._cell = None
+
+     def handle_data(self, data):
+          if self._cell is not None:
+               self._cell.append(data)
+
+     def extract(self, req_text):
+          try:
+               self.feed(req_text)
+               self.close()
+          except StopIteration:
+               pass
+          return self.header, self.rows
+
+# Observation table columns, in page order
+nws_actl_raw_columns = ['date', 'time', 'wind', 'visibility',
+                        'weather', 'sky_conditions', 'air_temp', 'dew_point',
+                        'temp_6_hour_max', 'temp_6_hour_min', 'relative_humidity',
+                        'wind_chill', 'heat_index', 'pressure',
+                        'pressure_mb', 'precip_1_hour', 'precip_3_hour', 'precip_6_hour']
+
 def parse_nws_actl_raw(req_text):
-     # Parse the HTML
-     soup = BeautifulSoup(req_text, 'html.parser')
-                  
-     # extract table data
-     table = soup.find_all('table')[3]
-     table_head = table.find_all('th')
-     table_rows = table.find_all('tr')[3:][:-3]
-     table_data = [tr.find_all('td') for tr in table_rows]
-     table_data = [[td.text for td in tr] for tr in table_data]   
-     table_data = np.array(table_data)
-
-     # Get time information from header
-     time_cols = [th.text for th in table_head if 'Time' in th]
+     # extract table data. The first three rows are headers, the last three
+     # repeat them.
+     table_head, table_rows = ObsTableExtractor().extract(req_text)
+     table_data = table_rows[3:][:-3]
+
+     # Get time information from header: the header cell with a 'Time' text
+     # node, e.g. 'Time' <br> '(cdt)'
+     time_cols = [''.join(th) for th in table_head if 'Time' in th]
      if len(time_cols) > 0:
           parse_time_attr = time_cols[0]
           if '(' in parse_time_attr and ')' in parse_time_attr:
@@ -161,33 +228,23 @@ def parse_nws_actl_raw(req_text):
      else:
           parse_time_zone = None
                
-     # convert table data to dataframe
-     df_nws_actl = pd.DataFrame(
-         table_data, 
-         columns=['date', 'time', 'wind', 'visibility',
-                  'weather', 'sky_conditions', 'air_temp', 'dew_point',
-                  'temp_6_hour_max', 'temp_6_hour_min', 'relative_humidity',
-                  'wind_chill', 'heat_index', 'pressure',
-                  'pressure_mb', 'precip_1_hour', 'precip_3_hour', 'precip_6_hour']
-     )
-     
-     # convert any NA values to np.nan
-     for c in df_nws_actl.columns:
-          df_nws_actl[c] = df_nws_actl[c].map(lambda x: '' if x == 'NA' else x)
+     # convert table data to dataframe, with any NA values as ''
+     df_nws_actl = pd.DataFrame(table_data, columns = nws_actl_raw_columns)
+     df_nws_actl = df_nws_actl.replace('NA', '')
      
-     # split wind information and rename raw wind data to wind_raw
-     # the first line of the following is a lazy hack. it is undone on the last line of this block
-     df_nws_actl['wind'] = df_nws_actl['wind'].map(lambda x: x + ' 0' if x.lower() in ['calm'] else x)
-     df_nws_actl['wind_dir'] = df_nws_actl['wind'].map(lambda x: x.split(' ')[0])
-     df_nws_actl['wind_speed'] = df_nws_actl['wind'].map(lambda x:  np.nan if len(x) == 0 else np.float(x.split(' ')[1]))    
-     gust_obs = df_nws_actl['wind'][df_nws_actl['wind'].str.contains('G')]#.map(lambda x: x.split('')[2:])
-     gust_speed = gust_obs.map(lambda x: int(x.split(' ')[3]))    
-     df_nws_actl['gust_speed'] = gust_speed    
+     # split wind information ('S 10', 'S 10 G 20' or 'Calm') and rename raw
+     # wind data to wind_raw
+     wind = df_nws_actl['wind']
+     is_calm = wind.str.lower() == 'calm'
+     wind_parts = wind.str.split(' ')
+     df_nws_actl['wind_dir'] = wind_parts.str[0]
+     df_nws_actl['wind_speed'] = wind_parts.str[1].mask(is_calm, '0').replace('', np.nan).astype(float)
+     df_nws_actl['gust_speed'] = wind_parts.str[3].where(wind.str.contains('G', regex = False)).astype(float)
      df_nws_actl.rename(columns = {'wind' : 'wind_raw'}, inplace=True)
-     df_nws_actl['wind_raw'] = df_nws_actl['wind_raw'].map(lambda x: 'Calm' if x.lower() == 'calm 0' else x)
+     df_nws_actl['wind_raw'] = wind.mask(is_calm, 'Calm')
      
      # remove percent signs from humidity
-     df_nws_actl['relative_humidity'] = df_nws_actl['relative_humidity'].map(lambda x: x.replace('%', ''))
+     df_nws_actl['relative_humidity'] = df_nws_actl['relative_humidity'].str.replace('%', '', regex = False)
      
      # the following variables are numeric
      numeric_var_list = ['visibility', 'air_temp', 'dew_point', 'relative_humidity',
@@ -195,11 +252,9 @@ def parse_nws_actl_raw(req_text):
                          'pressure_mb', 'precip_1_hour', 'precip_3_hour', 
                          'precip_6_hour', 'wind_chill', 'heat_index']
      
-     # convert the numeric variables to floats
+     # convert the numeric variables to floats, blanks to NaN
      for v in numeric_var_list:
-         tmp = df_nws_actl[v][np.where(df_nws_actl[v] != '')[0]]
-         tmp = tmp.astype(np.float)        
-         df_nws_actl[v] = tmp
+          df_nws_actl[v] = df_nws_actl[v].mask(df_nws_actl[v] == '').astype(float)
      
      # reorder columns back to original order
      df_nws_actl = df_nws_actl[[
@@ -232,10 +287,10 @@ non_dst_timezone_alts = {
      "US/Hawaii"   : 'US/Hawaii'
 }
 
-def parse_nws_actl(req_text, df_airports, airport_name, date_str_last_actl, date_str_retain = None):
+def parse_nws_actl(req_text, airport_catalog, airport_name, date_str_last_actl, date_str_retain = None):
      # Get url from table of URLS     
-     airport_df_row = df_airports[df_airports['icao_designation'] == airport_name]
-     tz_str = airport_df_row['time_zone'].iloc[0]
+     airport_row = airport_catalog.lookup(airport_name)
+     tz_str = airport_row['time_zone']
 
      # Datetime represents midnight on the last actual date for the pull
      datetime_last_actl = timezone(tz_str).localize(datetime.strptime(date_str_last_actl, '%Y-%m-%d'))
@@ -243,13 +298,13 @@ def parse_nws_actl(req_text, df_airports, airport_name, date_str_last_actl, date
      # Parse the raw HTML
      df_nws_actl, parse_time_zone = parse_nws_actl_raw(req_text)
 
-     # Is it daylight savings time?
-     is_dst = 'DT' in parse_time_zone.upper()
-
      # Early exit if None
      if df_nws_actl is None:
           return None
 
+     # Is it daylight savings time?
+     is_dst = 'DT' in parse_time_zone.upper()
+
      # Get columns
      cols = df_nws_actl.columns.to_list()
      
@@ -278,28 +333,27 @@ def parse_nws_actl(req_text, df_airports, airport_name, date_str_last_actl, date
      if month == 1:
           df_nws_actl['year'] = df_nws_actl['year'] - 1 * (df_nws_actl['day'] > day)
 
-     # Add hour and minute column for datetime computation          
-     df_nws_actl['hour']  = df_nws_actl['time'].apply(lambda x: int(x.split(':')[0]))     
-     df_nws_actl['minute']  = df_nws_actl['time'].apply(lambda x: int(x.split(':')[1]))
+     # Add hour and minute column for datetime computation
+     hour_minute = df_nws_actl['time'].str.split(':', n = 1, expand = True)
+     df_nws_actl['hour']   = hour_minute[0].astype(int)
+     df_nws_actl['minute'] = hour_minute[1].astype(int)
 
      # Naive Datetime
      df_nws_actl['datetime'] = pd.to_datetime(df_nws_actl[['year', 'month', 'day', 'hour', 'minute']])
 
-     # Be careful about transitions to DST!
+     # Be careful about transitions to DST! The page gives times in one fixed
+     # offset (e.g. cdt), so localize to that offset and convert to the
+     # airport's zone.
      if is_dst:
-          tz_str_alt = dst_timezone_alts[tz_str]
-          df_nws_actl['datetime'] = df_nws_actl['datetime'].apply(lambda x: timezone(tz_str_alt).localize(x))
-          df_nws_actl['datetime'] = df_nws_actl['datetime'].apply(lambda x: x.astimezone(tz_str))
+          tz_alt = timezone(dst_timezone_alts[tz_str])
      else:
-          tz_str_alt = non_dst_timezone_alts[tz_str]
-          df_nws_actl['datetime'] = df_nws_actl['datetime'].apply(lambda x: timezone(tz_str_alt).localize(x))
-          df_nws_actl['datetime'] = df_nws_actl['datetime'].apply(lambda x: x.astimezone(tz_str))
-          
+          tz_alt = timezone(non_dst_timezone_alts[tz_str])
+     df_nws_actl['datetime'] = df_nws_actl['datetime'].dt.tz_localize(tz_alt).dt.tz_convert(timezone(tz_str))
+
      # ensure matching
-     df_nws_actl['date'] = df_nws_actl['datetime'].apply(lambda x: x.strftime('%d'))
-     df_nws_actl['time'] = df_nws_actl['datetime'].apply(lambda x: x.strftime('%H:%M'))          
+     df_nws_actl['date'] = df_nws_actl['datetime'].dt.strftime('%d')
+     df_nws_actl['time'] = df_nws_actl['datetime'].dt.strftime('%H:%M')
 
-          
      # drop the temp columns
      df_nws_actl = df_nws_actl.drop(['year', 'month', 'day', 'hour', 'minute'], axis=1)
 
@@ -315,10 +369,10 @@ def parse_nws_actl(req_text, df_airports, airport_name, date_str_last_actl, date
      return df_nws_actl
      
 
-def pull_save_parse_nws_actl(airport_name, df_airports, out_dir = None):
+def pull_save_parse_nws_actl(airport_name, airport_catalog, out_dir = None, archive = None):
      # Get url from table of URLS     
-     airport_df_row = df_airports[df_airports['icao_designation'] == airport_name]
-     tz_str = airport_df_row['time_zone'].iloc[0]
+     airport_row = airport_catalog.lookup(airport_name)
+     tz_str = airport_row['time_zone']
 
      # Current time
      datetime_last_actl = datetime.now(get_localzone())
@@ -328,19 +382,21 @@ def pull_save_parse_nws_actl(airport_name, df_airports, out_dir = None):
      date_str_last_actl = datetime_last_actl.strftime('%Y-%m-%d')
      
      # Get the request
-     req_text = pull_nws_actl(airport_name, df_airports)
+     req_text = pull_nws_actl(airport_name, airport_catalog)
 
      if req_text is None:
           return None    
 
-     # Retain html file
+     # Retain html, in the raw archive if given
+     elif archive is not None:
+          archive.put(airport_name, 'actl', date_str_last_actl, req_text)
      elif out_dir is not None:
           actl_file_html = os.path.join(out_dir, 'nws_actl_{0}.html'.format(date_str_last_actl))
           with open(actl_file_html, 'w') as f:
                f.write(req_text)
 
      # Parse and create dataframe
-     df_nws_actl = parse_nws_actl(req_text, df_airports, airport_name, date_str_last_actl, date_str_last_actl)
+     df_nws_actl = parse_nws_actl(req_text, airport_catalog, airport_name, date_str_last_actl, date_str_last_actl)
 
      # If parsing failed, early return
      if df_nws_actl is None:
@@ -355,53 +411,93 @@ def pull_save_parse_nws_actl(airport_name, df_airports, out_dir = None):
      return df_nws_actl
 
 
-def pull_and_save(df_airports, df_airports_to_pull, pull_date_str, out_root = None):
-     # Iterate through list of airports and pull data
-     for i, row in df_airports_to_pull.iterrows():  
-          airport_name = row['icao_designation']
+# Airports fetched at once. The per-host limits in http_fetch keep this polite.
+fetch_workers = 8
+
+def pull_and_save_one(pull_kind, airport_name, airport_catalog, pull_date_str, airport_out_dir,
+                      archive = None):
+     # Pull, save and parse a forecast ('fcst') or actual ('actl'). Returns
+     # (status, seconds).
+     t0 = time.perf_counter()
+     try: 
+          print('Attempting to pull {0} for {1}.'.format(pull_kind, airport_name))
+          if pull_kind == 'fcst':
+               df = pull_save_parse_nws_fcst(airport_name, airport_catalog, pull_date_str,
+                                             out_dir = airport_out_dir, archive = archive)
+          else:
+               df = pull_save_parse_nws_actl(airport_name, airport_catalog,
+                                             out_dir = airport_out_dir, archive = archive)
                
-          # Create output dir for airport if it doesn't exist
-          if out_root is not None:
-               airport_out_dir = os.path.join(out_root, airport_name)               
-               pathlib.Path(airport_out_dir).mkdir(parents=True, exist_ok=True)
+          if df is not None:
+               print('Successful {0} pull for {1} on {2}.'.format(pull_kind, airport_name, pull_date_str))
+               status = 'ok'
           else:
-               airport_out_dir = None
+               print('No {0} result was returned for {1} for {2}.'.format(pull_kind, airport_name, pull_date_str))
+               status = 'none'
+     except Exception as e:
+          print('Error while pulling {0} for {1}: {2!r}'.format(pull_kind, airport_name, e))
+          status = 'error'
+     sys.stdout.flush()
           
-          # Pull Forecast
-          try: 
-               print('Attempting to pull forecast for {0}.'.format(airport_name))
-               df_fcst = pull_save_parse_nws_fcst(airport_name, df_airports, pull_date_str, out_dir = airport_out_dir)
-               if df_fcst is not None:
-                    print('Successful fcst pull for {0} on {1}.'.format(airport_name, pull_date_str))
-               else:
-                    print('No fcst result was returned for {0} for {1}.'.format(airport_name, pull_date_str))
-          except:
-               print('Error while pulling fcst for {0}.'.format(airport_name))
+     return status, time.perf_counter() - t0
+
+def pull_and_save(airport_catalog, airports_to_pull, pull_date_str, out_root = None,
+                  max_workers = None):
+     # Pull forecasts and actuals for the airports concurrently. Requests are
+     # rate limited per host and share one retry budget (see http_fetch), so
+     # the fcst and obhistory hosts are fetched in parallel. Returns {airport : {kind : (status, seconds)}}.
+     if max_workers is None:
+          max_workers = fetch_workers
+     t0 = time.perf_counter()
+
+     # Fresh retry budget for the batch
+     get_fetch_client().start_run()
+
+     # Raw pages go to the compressed archive under out_root (see raw_archive)
+     archive = get_raw_archive(out_root) if out_root is not None else None
           
-          # Pull actual data
-          try: 
-               print('Attempting to pull actual for {0}.'.format(airport_name))
-               df_actl = pull_save_parse_nws_actl(airport_name, df_airports, out_dir = airport_out_dir)
-               if df_actl is not None:
-                    print('Successful actl pull for {0} on {1}.'.format(airport_name, pull_date_str))
+     futures = {}
+     with ThreadPoolExecutor(max_workers = max_workers) as executor:
+          for airport_row in airports_to_pull:  
+               airport_name = airport_row['icao_designation']
+               
+               # Create output dir for airport if it doesn't exist
+               if out_root is not None:
+                    airport_out_dir = os.path.join(out_root, airport_name)               
+                    pathlib.Path(airport_out_dir).mkdir(parents=True, exist_ok=True)
                else:
-                    print('No actl result was returned for {0} for {1}.'.format(airport_name, pull_date_str))
-          except:
-               print('Error while pulling actl for {0}.'.format(airport_name))
-          
-          # Sleep for a few seconds
-          random_sleep()
-          sys.stdout.flush()
+                    airport_out_dir = None
+
+               for pull_kind in ['fcst', 'actl']:
+                    future = executor.submit(pull_and_save_one, pull_kind, airport_name,
+                                             airport_catalog, pull_date_str, airport_out_dir, archive)
+                    futures[future] = (airport_name, pull_kind)
+
+     # Per-airport timing
+     pull_timings = {}
+     for future, (airport_name, pull_kind) in futures.items():
+          pull_timings.setdefault(airport_name, {})[pull_kind] = future.result()
+
+     print('{0:<6} {1:>12} {2:>12}'.format('', 'fcst', 'actl'))
+     for airport_name, timings in pull_timings.items():
+          print('{0:<6} {1:>12} {2:>12}'.format(
+               airport_name,
+               *['{0} {1:5.1f}s'.format(*timings[k]) for k in ['fcst', 'actl']]
+          ))
+     print('Pulled {0} airports in {1:.1f} seconds.'.format(len(pull_timings), time.perf_counter() - t0))
+     sys.stdout.flush()
+
+     return pull_timings
 
           
-def midnight_pull_df(df_airports):
+def midnight_pull_df(airport_catalog):
      # what time zone is it midnight in?
      tz_to_run, pull_date_str = midnight_time_zone()
 
      # List of airports to pull
-     df_airports_to_pull = df_airports[df_airports['time_zone'] == tz_to_run]
+     airports_to_pull = airport_catalog.by_time_zone(tz_to_run)
      
-     return  df_airports_to_pull, pull_date_str
+     return  airports_to_pull, pull_date_str
 
 
 def midnight_time_zone():
@@ -432,7 +528,7 @@ def midnight_time_zone():
      return tz_to_run, pull_date_str
 
 
-def midnight_pull_and_save(df_airports, out_root = None):
+def midnight_pull_and_save(airport_catalog, out_root = None):
      # Grab the list if airports for this range
-     df_airports_to_pull, pull_date_str = midnight_pull_df(df_airports)
-     pull_and_save(df_airports, df_airports_to_pull, pull_date_str, out_root)
+     airports_to_pull, pull_date_str = midnight_pull_df(airport_catalog)
+     pull_and_save(airport_catalog, airports_to_pull, pull_date_str, out_root)
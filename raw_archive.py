@@ -0,0 +1,284 @@
+import os
+import re
+import gzip
+import hashlib
+import sqlite3
+import argparse
+import threading
+
+# zstd compresses the pulled pages better and faster when it is installed.
+# Each blob records its codec, so archives written either way stay readable.
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Raw NWS responses kept as compressed, append-only pack files, one per
+# airport and month:
+#
+#   <root>/<airport>/raw_<YYYY-MM>.pack
+#
+# An index next to the packs maps (airport, kind, date) to the blob holding
+# the response. Blobs are keyed on the sha1 of the text, so a page pulled
+# twice unchanged is stored once. Packs are only ever appended to; bytes
+# written before a crash but never indexed are simply unreachable.
+
+# Kinds of pulls and the loose file names they used to be saved under
+raw_file_patterns = {
+    'fcst' : re.compile(r'^nws_fcst_(\d{4}-\d{2}-\d{2})\.xml$'),
+    'actl' : re.compile(r'^nws_actl_(\d{4}-\d{2}-\d{2})\.html$'),
+}
+
+gzip_level = 9
+zstd_level = 10
+
+
+def compress_text(data):
+    # (codec, compressed bytes) for utf-8 text, with the best codec available
+    if zstandard is not None:
+        return 'zstd', zstandard.ZstdCompressor(level = zstd_level).compress(data)
+    return 'gzip', gzip.compress(data, compresslevel = gzip_level)
+
+
+def decompress_text(codec, blob):
+    if codec == 'gzip':
+        data = gzip.decompress(blob)
+    elif codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('zstandard is needed to read zstd blobs from the raw archive')
+        data = zstandard.ZstdDecompressor().decompress(blob)
+    else:
+        raise ValueError('Unknown raw archive codec: {0}'.format(codec))
+    return data.decode('utf-8')
+
+
+class RawArchive:
+    # Store for the raw pulled pages under root. Safe to share between the
+    # threads of one pull.
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+
+        self._index_conn = sqlite3.connect(
+            os.path.join(root, 'raw_archive.sqlite'), timeout = 10, check_same_thread = False
+        )
+        self._index_conn.execute('PRAGMA journal_mode = WAL')
+        self._index_conn.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS raw_blob (
+             sha1        TEXT PRIMARY KEY
+            ,pack_path   TEXT    NOT NULL
+            ,offset      INTEGER NOT NULL
+            ,length      INTEGER NOT NULL
+            ,codec       TEXT    NOT NULL
+            ,raw_size    INTEGER NOT NULL
+            )
+            '''
+        )
+        self._index_conn.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS raw_entry (
+             airport_name TEXT NOT NULL
+            ,kind         TEXT NOT NULL
+            ,date         TEXT NOT NULL
+            ,sha1         TEXT NOT NULL REFERENCES raw_blob (sha1)
+            ,PRIMARY KEY (airport_name, kind, date)
+            )
+            '''
+        )
+        self._index_conn.commit()
+
+    def pack_path(self, airport_name, date_str):
+        # Relative to root, so the archive can be moved as a whole
+        return os.path.join(airport_name, 'raw_{0}.pack'.format(date_str[:7]))
+
+    def put(self, airport_name, kind, date_str, text):
+        # Archive the page pulled for (airport, kind, date), replacing any
+        # earlier one. Returns True if new bytes were written, False if the
+        # same text was already stored.
+        if kind not in raw_file_patterns:
+            raise ValueError('Unknown raw archive kind: {0}'.format(kind))
+        data = text.encode('utf-8')
+        sha1 = hashlib.sha1(data).hexdigest()
+
+        with self._lock:
+            written = False
+            known = self._index_conn.execute(
+                'SELECT 1 FROM raw_blob WHERE sha1 = ?', (sha1,)
+            ).fetchone()
+
+            if known is None:
+                codec, blob = compress_text(data)
+                pack_path = self.pack_path(airport_name, date_str)
+                full_path = os.path.join(self.root, pack_path)
+                os.makedirs(os.path.dirname(full_path), exist_ok = True)
+
+                # The blob is on disk before the index points at it
+                with open(full_path, 'ab') as f:
+                    offset = f.seek(0, os.SEEK_END)
+                    f.write(blob)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+                self._index_conn.execute(
+                    '''
+                    INSERT INTO raw_blob (sha1, pack_path, offset, length, codec, raw_size)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ''',
+                    (sha1, pack_path, offset, len(blob), codec, len(data))
+                )
+                written = True
+
+            self._index_conn.execute(
+                '''
+                INSERT OR REPLACE INTO raw_entry (airport_name, kind, date, sha1)
+                VALUES (?, ?, ?, ?)
+                ''',
+                (airport_name, kind, date_str, sha1)
+            )
+            self._index_conn.commit()
+
+        return written
+
+    def get(self, airport_name, kind, date_str):
+        # Text of the archived page, or None
+        with self._lock:
+            row = self._index_conn.execute(
+                '''
+                SELECT b.pack_path, b.offset, b.length, b.codec
+                FROM raw_entry as e
+                INNER JOIN raw_blob as b
+                ON e.sha1 = b.sha1
+                WHERE e.airport_name = ?
+                AND e.kind = ?
+                AND e.date = ?
+                ''',
+                (airport_name, kind, date_str)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        pack_path, offset, length, codec = row
+        with open(os.path.join(self.root, pack_path), 'rb') as f:
+            f.seek(offset)
+            return decompress_text(codec, f.read(length))
+
+    def entries(self, airport_name = None, kind = None, start_date = None, end_date = None):
+        # Yields (airport_name, kind, date, text) for the archived pages,
+        # filtered as given (dates inclusive). Pages are read in pack order,
+        # each pack opened once, so a reparse reads sequentially.
+        conditions = []
+        params = []
+        for column, value, op in [('e.airport_name', airport_name, '='),
+                                  ('e.kind', kind, '='),
+                                  ('e.date', start_date, '>='),
+                                  ('e.date', end_date, '<=')]:
+            if value is not None:
+                conditions.append('{0} {1} ?'.format(column, op))
+                params.append(value)
+
+        with self._lock:
+            rows = self._index_conn.execute(
+                '''
+                SELECT e.airport_name, e.kind, e.date, b.pack_path, b.offset, b.length, b.codec
+                FROM raw_entry as e
+                INNER JOIN raw_blob as b
+                ON e.sha1 = b.sha1
+                {where_clause}
+                ORDER BY b.pack_path, b.offset
+                '''.format(
+                    where_clause = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+                ),
+                params
+            ).fetchall()
+
+        f = None
+        f_path = None
+        try:
+            for airport, entry_kind, date_str, pack_path, offset, length, codec in rows:
+                if pack_path != f_path:
+                    if f is not None:
+                        f.close()
+                    f = open(os.path.join(self.root, pack_path), 'rb')
+                    f_path = pack_path
+                f.seek(offset)
+                yield airport, entry_kind, date_str, decompress_text(codec, f.read(length))
+        finally:
+            if f is not None:
+                f.close()
+
+    def stats(self):
+        # Counts and sizes, for reporting
+        with self._lock:
+            n_entries, = self._index_conn.execute('SELECT count(*) FROM raw_entry').fetchone()
+            n_blobs, stored, raw = self._index_conn.execute(
+                'SELECT count(*), total(length), total(raw_size) FROM raw_blob'
+            ).fetchone()
+        return {'entries' : n_entries, 'blobs' : n_blobs,
+                'stored_bytes' : int(stored), 'raw_bytes' : int(raw)}
+
+    def import_loose_files(self, remove = False):
+        # Archive the nws_fcst_*.xml / nws_actl_*.html files saved by earlier
+        # pulls under root/<airport>/, optionally deleting them once stored.
+        # Returns the number of files imported.
+        n_imported = 0
+        for airport_name in sorted(os.listdir(self.root)):
+            airport_dir = os.path.join(self.root, airport_name)
+            if not os.path.isdir(airport_dir):
+                continue
+
+            for file_name in sorted(os.listdir(airport_dir)):
+                for kind, pattern in raw_file_patterns.items():
+                    match = pattern.match(file_name)
+                    if match is None:
+                        continue
+
+                    file_path = os.path.join(airport_dir, file_name)
+                    with open(file_path) as f:
+                        text = f.read()
+                    self.put(airport_name, kind, match.group(1), text)
+                    n_imported += 1
+
+                    if remove:
+                        os.remove(file_path)
+
+        return n_imported
+
+
+_archives = {}
+_archives_lock = threading.Lock()
+
+def get_raw_archive(root):
+    # Shared archive for root in this process
+    root = os.path.abspath(root)
+    with _archives_lock:
+        archive = _archives.get(root)
+        if archive is None:
+            archive = _archives[root] = RawArchive(root)
+    return archive
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Raw NWS page archive')
+    parser.add_argument('command', choices = ['import', 'stats'])
+    parser.add_argument('--root', default = None,
+                        help = 'archive root (default: data_input_root from db_setup)')
+    parser.add_argument('--remove', action = 'store_true',
+                        help = 'delete loose files once imported')
+    args = parser.parse_args()
+
+    root = args.root
+    if root is None:
+        from db_setup import data_input_root
+        root = data_input_root
+    archive = get_raw_archive(root)
+
+    if args.command == 'import':
+        n_imported = archive.import_loose_files(remove = args.remove)
+        print('Imported {0} files.'.format(n_imported))
+
+    stats = archive.stats()
+    print('{0} pages in {1} blobs, {2:.1f} MB stored for {3:.1f} MB of text.'.format(
+        stats['entries'], stats['blobs'], stats['stored_bytes'] / 1e6, stats['raw_bytes'] / 1e6))
@@ -0,0 +1,190 @@
+import os
+import sqlite3
+import time
+
+from db_setup import weather_db_loc
+
+# Shared by all of the uWSGI worker processes. Lives next to the weather db.
+response_cache_loc = os.path.join(
+    os.path.dirname(weather_db_loc),
+    'weather_response_cache.sqlite'
+)
+
+# Least recently used entries beyond this are evicted
+response_cache_max_entries = 512
+
+# Hits don't write. Their last_access times are kept per process and
+# written together at most this often (seconds), and before any eviction.
+cache_touch_interval = 30.0
+
+# One connection per process. uWSGI forks workers after import, so the
+# connection must not be shared with the parent.
+_cache_conn = None
+_cache_conn_pid = None
+
+# cache_key : last access, for hits not yet written
+_pending_touches = {}
+_touches_flushed_at = 0.0
+
+
+def get_cache_conn():
+    global _cache_conn, _cache_conn_pid, _touches_flushed_at
+
+    if _cache_conn is None or _cache_conn_pid != os.getpid():
+        _pending_touches.clear()
+        _touches_flushed_at = time.time()
+        conn = sqlite3.connect(response_cache_loc, timeout = 10)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        create_cache_tables(conn)
+        _cache_conn = conn
+        _cache_conn_pid = os.getpid()
+
+    return _cache_conn
+
+
+def create_cache_tables(cache_conn):
+    cur = cache_conn.cursor()
+    cur.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS data_generation (
+         id          INTEGER PRIMARY KEY CHECK (id = 0)
+        ,generation  INTEGER NOT NULL
+        ,updated_at  REAL    NOT NULL
+        )
+        '''
+    )
+    cur.execute(
+        '''
+        INSERT OR IGNORE INTO data_generation (id, generation, updated_at)
+        VALUES (0, 0, ?)
+        ''',
+        (time.time(),)
+    )
+    cur.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS response_cache (
+         cache_key   TEXT PRIMARY KEY
+        ,generation  INTEGER NOT NULL
+        ,body        TEXT    NOT NULL
+        ,last_access REAL    NOT NULL
+        )
+        '''
+    )
+    cur.execute(
+        '''
+        CREATE INDEX IF NOT EXISTS response_cache_last_access
+        ON response_cache (last_access)
+        '''
+    )
+    cache_conn.commit()
+
+
+def get_data_generation():
+    # Counter bumped after every ingest, and the time it was bumped
+    cur = get_cache_conn().cursor()
+    cur.execute('SELECT generation, updated_at FROM data_generation WHERE id = 0')
+    generation, updated_at = cur.fetchone()
+
+    return generation, updated_at
+
+
+def bump_data_generation():
+    # Invalidate every cached response built from older data
+    conn = get_cache_conn()
+    cur  = conn.cursor()
+    cur.execute(
+        '''
+        UPDATE data_generation
+        SET generation = generation + 1, updated_at = ?
+        WHERE id = 0
+        ''',
+        (time.time(),)
+    )
+    cur.execute(
+        '''
+        DELETE FROM response_cache
+        WHERE generation < (SELECT generation FROM data_generation WHERE id = 0)
+        '''
+    )
+    conn.commit()
+
+
+def make_cache_key(generation, name, params):
+    return '{0}|{1}|{2}'.format(generation, name, '|'.join(str(p) for p in params))
+
+
+def cache_get(cache_key):
+    conn = get_cache_conn()
+    cur  = conn.cursor()
+    cur.execute('SELECT body FROM response_cache WHERE cache_key = ?', (cache_key,))
+    row = cur.fetchone()
+
+    if row is None:
+        return None
+
+    now = time.time()
+    _pending_touches[cache_key] = now
+    if now - _touches_flushed_at >= cache_touch_interval:
+        flush_cache_touches()
+
+    return row[0]
+
+
+def flush_cache_touches():
+    # Write the batched last_access times of hits in one transaction
+    global _touches_flushed_at
+
+    conn = get_cache_conn()
+    if _pending_touches:
+        conn.executemany(
+            'UPDATE response_cache SET last_access = max(last_access, ?) WHERE cache_key = ?',
+            [(t, k) for k, t in _pending_touches.items()]
+        )
+        conn.commit()
+        _pending_touches.clear()
+    _touches_flushed_at = time.time()
+
+
+def cache_put(cache_key, generation, body):
+    # Recent hits count before choosing what to evict
+    flush_cache_touches()
+
+    conn = get_cache_conn()
+    cur  = conn.cursor()
+    cur.execute(
+        '''
+        INSERT OR REPLACE INTO response_cache (cache_key, generation, body, last_access)
+        VALUES (?, ?, ?, ?)
+        ''',
+        (cache_key, generation, body, time.time())
+    )
+
+    # Evict least recently used entries past the size bound
+    cur.execute(
+        '''
+        DELETE FROM response_cache
+        WHERE cache_key IN (
+            SELECT cache_key
+            FROM response_cache
+            ORDER BY last_access DESC
+            LIMIT -1 OFFSET ?
+        )
+        ''',
+        (response_cache_max_entries,)
+    )
+    conn.commit()
+
+
+def get_or_compute(name, params, compute):
+    # Return the cached body for (data generation, name, params), computing
+    # and storing it on a miss
+    generation, _ = get_data_generation()
+    cache_key = make_cache_key(generation, name, params)
+
+    body = cache_get(cache_key)
+    if body is None:
+        body = compute()
+        cache_put(cache_key, generation, body)
+
+    return body
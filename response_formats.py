@@ -0,0 +1,96 @@
+import sys
+import json
+from array import array
+from datetime import datetime, timezone
+
+# Columns sent as epoch seconds in the packed format
+time_columns = ('forecast_time_stamps', 'datetime')
+date_columns = ('pull_date',)
+
+# Columns left out of the packed format
+text_columns = ('weather',)
+
+# Packed value for a missing time or date. 0 is a real instant
+# (1970-01-01), so the smallest int32 stands in for NULL.
+missing_epoch = -2 ** 31
+
+
+def rows_to_columnar(columns, rows):
+    # {column : [values...]} straight from the cursor rows
+    if len(rows) == 0:
+        return {col : [] for col in columns}
+
+    return {col : list(values) for col, values in zip(columns, zip(*rows))}
+
+
+def time_str_to_epoch(time_str):
+    # Text time stamps carry their own UTC offset
+    if time_str is None:
+        return missing_epoch
+    return int(datetime.fromisoformat(time_str).timestamp())
+
+
+def date_str_to_epoch(date_str):
+    # Dates have no offset. Use midnight UTC.
+    if date_str is None:
+        return missing_epoch
+    date_time = datetime.strptime(date_str, '%Y-%m-%d').replace(tzinfo = timezone.utc)
+    return int(date_time.timestamp())
+
+
+def to_float(v):
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+def rows_to_packed(columns, rows):
+    # Little-endian column blocks, one after another: int32 epoch seconds
+    # for time and date columns (missing_epoch, i.e. INT32_MIN, for
+    # missing), float32 (NaN for missing) for numeric ones. Text columns
+    # are not included. Returns the bytes and the layout as
+    # 'name:type' strings.
+    col_values = zip(*rows) if len(rows) > 0 else [() for _ in columns]
+
+    blocks = []
+    layout = []
+    for col, values in zip(columns, col_values):
+        if col in time_columns:
+            block = array('i', [time_str_to_epoch(v) for v in values])
+            layout.append('{0}:i4'.format(col))
+        elif col in date_columns:
+            block = array('i', [date_str_to_epoch(v) for v in values])
+            layout.append('{0}:i4'.format(col))
+        elif col in text_columns:
+            continue
+        else:
+            block = array('f', [to_float(v) for v in values])
+            layout.append('{0}:f4'.format(col))
+
+        if sys.byteorder == 'big':
+            block.byteswap()
+        blocks.append(block.tobytes())
+
+    return b''.join(blocks), layout
+
+
+def stream_json_records(c, chunk_size = 1000):
+    # Yield a JSON list of {column : value} objects in chunks, reading the
+    # cursor with fetchmany so the full result is never held in memory
+    columns = [desc[0] for desc in c.description]
+
+    yield '['
+    first = True
+    while True:
+        rows = c.fetchmany(chunk_size)
+        if not rows:
+            break
+
+        chunk = ','.join(json.dumps(dict(zip(columns, row))) for row in rows)
+        if first:
+            yield chunk
+            first = False
+        else:
+            yield ',' + chunk
+    yield ']'
@@ -0,0 +1,148 @@
+from datetime import datetime, timedelta
+
+from db_connections import get_write_connection
+from error_stats import (sums_rollup_query, hist_rollup_query,
+                         avf_error_metrics, fvf_error_metrics)
+
+# Forecast-vs-forecast deltas. Each cell holds the pairs of forecasts
+# (f1, f2) for the same time stamp where f2 was pulled after f1.
+fvf_key_columns = ['airport_name', 'day_of_snp1', 'day_of_snp2', 'fcst_hour']
+
+fvf_cells_query = '''
+    SELECT
+     f1.airport_name
+    ,f1.forecast_lead_day as day_of_snp1
+    ,f2.forecast_lead_day as day_of_snp2
+    ,f2.forecast_local_hour as fcst_hour
+    ,f2.temperature_hourly - f1.temperature_hourly as temp_delta
+    ,f2.probability_of_precipitation_floating - f1.probability_of_precipitation_floating as prob_precip_delta
+    ,f2.wind_speed_sustained - f1.wind_speed_sustained as wind_speed_delta
+    FROM weather_fcst as f1
+    INNER JOIN weather_fcst as f2
+    ON f1.forecast_utc_epoch = f2.forecast_utc_epoch
+    AND f1.airport_name = f2.airport_name
+    WHERE f2.pull_date > f1.pull_date
+    {where_clause}
+'''
+
+fvf_rollup_queries = [
+    sums_rollup_query('weather_fvf_rollup', fvf_key_columns, fvf_error_metrics, 'cnt_snp2_v_snp1'),
+    hist_rollup_query('weather_fvf_hist', fvf_key_columns, fvf_error_metrics),
+]
+
+# Actual-vs-forecast deltas per (interp_day, interp_hour) cell
+avf_key_columns = ['airport_name', 'interp_day', 'interp_hour']
+
+avf_cells_query = '''
+    SELECT
+     airport_name
+    ,interp_day
+    ,interp_hour
+    ,temp_delta
+    ,wind_speed_delta
+    ,prob_precip_delta
+    FROM weather_avf_compare
+    WHERE interp_day IS NOT NULL
+    {where_clause}
+'''
+
+avf_rollup_queries = [
+    sums_rollup_query('weather_avf_rollup', avf_key_columns, avf_error_metrics),
+    hist_rollup_query('weather_avf_hist', avf_key_columns, avf_error_metrics),
+]
+
+
+def apply_rollup(db_conn, cells_query, rollup_queries, query_params = ()):
+    # Select the new cells once into a temp table and fold them into the
+    # partial sums and the histograms
+    cur = db_conn.cursor()
+    cur.execute('DROP TABLE IF EXISTS temp.cells')
+    cur.execute('CREATE TEMP TABLE cells AS ' + cells_query, query_params)
+    for query in rollup_queries:
+        cur.execute(query)
+    cur.execute('DROP TABLE temp.cells')
+
+
+def update_fvf_rollup(db_conn, airport_name, pull_dt):
+    # Fold every pair involving the newly ingested pull date into the rollup.
+    # The new pull date can be either the later (usual) or the earlier
+    # (backfilled) forecast of a pair, but never both.
+    query_params = (airport_name, pull_dt, pull_dt)
+    apply_rollup(
+        db_conn,
+        fvf_cells_query.format(
+            where_clause = '''
+            AND f1.airport_name = ?
+            AND (f1.pull_date = ? OR f2.pull_date = ?)
+            '''
+        ),
+        fvf_rollup_queries,
+        query_params
+    )
+    db_conn.commit()
+
+
+def rebuild_fvf_rollup(db_conn, airport_name = None):
+    # Recompute the rollup from the full forecast history
+    cur = db_conn.cursor()
+    if airport_name is None:
+        cur.execute('DELETE FROM weather_fvf_rollup')
+        cur.execute('DELETE FROM weather_fvf_hist')
+        apply_rollup(db_conn, fvf_cells_query.format(where_clause = ''),
+                     fvf_rollup_queries)
+    else:
+        cur.execute('DELETE FROM weather_fvf_rollup WHERE airport_name = ?',
+                    (airport_name,))
+        cur.execute('DELETE FROM weather_fvf_hist WHERE airport_name = ?',
+                    (airport_name,))
+        apply_rollup(db_conn, fvf_cells_query.format(where_clause = 'AND f1.airport_name = ?'),
+                     fvf_rollup_queries, (airport_name,))
+    db_conn.commit()
+
+
+def update_avf_rollup(db_conn, airport_name, fcst_date_str, commit = True):
+    # Fold the comparison rows for a newly loaded date into the rollup. Uses
+    # the same date window as check_nws_avf_compare_loaded.
+    fcst_date_time = datetime.strptime(fcst_date_str, '%Y-%m-%d')
+    next_date_str = (fcst_date_time + timedelta(days = 1)).strftime('%Y-%m-%d')
+
+    query_params = (airport_name, fcst_date_str, next_date_str)
+    apply_rollup(
+        db_conn,
+        avf_cells_query.format(
+            where_clause = '''
+            AND airport_name = ?
+            AND datetime >= ?
+            AND datetime <  ?
+            '''
+        ),
+        avf_rollup_queries,
+        query_params
+    )
+    if commit:
+        db_conn.commit()
+
+
+def rebuild_avf_rollup(db_conn, airport_name = None):
+    # Recompute the rollup from the full comparison history
+    cur = db_conn.cursor()
+    if airport_name is None:
+        cur.execute('DELETE FROM weather_avf_rollup')
+        cur.execute('DELETE FROM weather_avf_hist')
+        apply_rollup(db_conn, avf_cells_query.format(where_clause = ''),
+                     avf_rollup_queries)
+    else:
+        cur.execute('DELETE FROM weather_avf_rollup WHERE airport_name = ?',
+                    (airport_name,))
+        cur.execute('DELETE FROM weather_avf_hist WHERE airport_name = ?',
+                    (airport_name,))
+        apply_rollup(db_conn, avf_cells_query.format(where_clause = 'AND airport_name = ?'),
+                     avf_rollup_queries, (airport_name,))
+    db_conn.commit()
+
+
+if __name__ == '__main__':
+    # Build the rollup tables for an existing database
+    db_conn = get_write_connection()
+    rebuild_fvf_rollup(db_conn)
+    rebuild_avf_rollup(db_conn)
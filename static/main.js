@@ -332,18 +332,14 @@ function makeGraphs(airport, start_date_str, end_date_str){
   
   var div = d3.select('#graph_div');      
 
-  // query the database in the following places
-  fcst_query_url = "/weather-app/query?airport=" + airport + "&af_type=fcst" + "&start_date_str=" + start_date_str + "&end_date_str=" + end_date_str;
-  actl_query_url = "/weather-app/query?airport=" + airport + "&af_type=actl" + "&start_date_str=" + start_date_str + "&end_date_str=" + end_date_str;
+  // query the database for both series in one request
+  combined_query_url = "/weather-app/query_combined?airport=" + airport + "&start_date_str=" + start_date_str + "&end_date_str=" + end_date_str;
 
-  Promise.all([
-    d3.json(fcst_query_url),
-    d3.json(actl_query_url),
-  ]).then(function(data) {
+  d3.json(combined_query_url).then(function(data) {
 
     // obtain the data
-    dataFcst = data[0];
-    dataActl = data[1];
+    dataFcst = data['fcst'];
+    dataActl = data['actl'];
 
     // get the max and min times from the forecast data
     var parseTime = d3.isoParse;  
@@ -399,18 +395,14 @@ function updateGraphs(airport, start_date_str, end_date_str){
   
   var div = d3.select('#graph_div');
 
-  // query the database in the following places
-  fcst_query_url = "/weather-app/query?airport=" + airport + "&af_type=fcst" + "&start_date_str=" + start_date_str + "&end_date_str=" + end_date_str;
-  actl_query_url = "/weather-app/query?airport=" + airport + "&af_type=actl" + "&start_date_str=" + start_date_str + "&end_date_str=" + end_date_str;
+  // query the database for both series in one request
+  combined_query_url = "/weather-app/query_combined?airport=" + airport + "&start_date_str=" + start_date_str + "&end_date_str=" + end_date_str;
 
-  Promise.all([
-    d3.json(fcst_query_url),
-    d3.json(actl_query_url),
-  ]).then(function(data) {
+  d3.json(combined_query_url).then(function(data) {
 
     // obtain the data
-    dataFcst = data[0];
-    dataActl = data[1];
+    dataFcst = data['fcst'];
+    dataActl = data['actl'];
 
     // get the max and min times from the forecast data
     var parseTime = d3.isoParse;  
@@ -0,0 +1,60 @@
+from datetime import datetime
+from pytz import timezone
+
+# Integer time columns kept alongside the tz-suffixed text time stamps,
+# as SQL expressions over the text columns. SQLite's strftime honours
+# the '-05:00' style offsets.
+fcst_time_columns = {
+    'forecast_utc_epoch'  : "cast(strftime('%s', forecast_time_stamps) as integer)",
+    'forecast_local_hour' : "cast(substr(forecast_time_stamps, 12, 2) as integer)",
+    # Whole days from local midnight on the pull date
+    'forecast_lead_day'   : ("(strftime('%s', forecast_time_stamps) - "
+                             "strftime('%s', pull_date || ' 00:00:00-' || substr(forecast_time_stamps, 21)))"
+                             " / 86400"),
+}
+
+actl_time_columns = {
+    'datetime_utc_epoch'  : "cast(strftime('%s', datetime) as integer)",
+    'datetime_local_hour' : "cast(substr(datetime, 12, 2) as integer)",
+}
+
+avf_time_columns = {
+    'datetime_utc_epoch'  : "cast(strftime('%s', datetime) as integer)",
+}
+
+# table : (column that is NULL until filled, columns)
+time_column_tables = {
+    'weather_fcst'        : ('forecast_utc_epoch', fcst_time_columns),
+    'weather_actl'        : ('datetime_utc_epoch', actl_time_columns),
+    'weather_avf_compare' : ('datetime_utc_epoch', avf_time_columns),
+}
+
+
+def fill_time_columns(db_conn, table_name, airport_name = None, commit = True):
+    # Populate the integer time columns for rows that do not have them yet
+    epoch_column, columns = time_column_tables[table_name]
+    set_clause = ', '.join('{0} = {1}'.format(c, e) for c, e in columns.items())
+
+    if airport_name is None:
+        where_clause = '{0} IS NULL'.format(epoch_column)
+        query_params = ()
+    else:
+        where_clause = 'airport_name = ? AND {0} IS NULL'.format(epoch_column)
+        query_params = (airport_name,)
+
+    cur = db_conn.cursor()
+    cur.execute(
+        'UPDATE {0} SET {1} WHERE {2}'.format(table_name, set_clause, where_clause),
+        query_params
+    )
+    if commit:
+        db_conn.commit()
+
+
+def local_date_to_utc_epoch(date_str, tz_str):
+    # Local midnight at the start of a 'YYYY-MM-DD' date, as UTC epoch seconds
+    if date_str is None:
+        return None
+
+    local_midnight = timezone(tz_str).localize(datetime.strptime(date_str[:10], '%Y-%m-%d'))
+    return int(local_midnight.timestamp())
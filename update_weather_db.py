@@ -5,6 +5,9 @@ import pandas as pd
 from datetime import datetime, timedelta
 from pytz import timezone
 from forecast_tools import get_avf_compare, get_fcst, get_actl
+from rollups import update_fvf_rollup, update_avf_rollup
+from time_columns import fill_time_columns
+from loader_memo import loader_memo
 
 
 def check_table_exists(db_conn, table_name):
@@ -89,6 +92,7 @@ def update_nws_actl_db(db_conn, airport_name, df_nws_actl, actl_dt):
         # Load data
         df_nws_actl.to_sql('weather_actl', index=False, con = db_conn,
                            if_exists='append')
+        fill_time_columns(db_conn, 'weather_actl', airport_name)
         
 def check_nws_fcst_loaded(db_conn, airport_name, pull_dt):
     # Check if table exists
@@ -149,6 +153,10 @@ def update_nws_fcst_db(db_conn, airport_name, df_nws_fcst, pull_dt):
         # Load data
         df_nws_fcst.to_sql('weather_fcst', index=False, con = db_conn,
                            if_exists='append')
+        fill_time_columns(db_conn, 'weather_fcst', airport_name)
+
+        # Fold the new pull date into the forecast-vs-forecast rollup
+        update_fvf_rollup(db_conn, airport_name, pull_dt)
 
 
 def check_nws_avf_compare_loaded(db_conn, airport_name, fcst_date_str):
@@ -183,14 +191,65 @@ def check_nws_avf_compare_loaded(db_conn, airport_name, fcst_date_str):
 
     return query_result is not None
 
-def update_nws_avf_compare_db(db_conn, airport_name, fcst_date_str):
-    # db columns    
-    columns = ['airport_name', 'pull_date', 'datetime',
-               'interp_seconds', 'interp_day', 'interp_hour',
-               'fcst_temperature', 'fcst_wind_speed',
-               'fcst_precip_prob', 'air_temp', 'wind_speed',
-               'precip_1_hour', 'temp_delta', 'wind_speed_delta']
+# weather_avf_compare columns
+avf_compare_columns = ['airport_name', 'pull_date', 'datetime',
+                       'interp_seconds', 'interp_day', 'interp_hour',
+                       'fcst_temperature', 'fcst_wind_speed',
+                       'fcst_precip_prob', 'air_temp', 'wind_speed',
+                       'precip_1_hour', 'temp_delta', 'wind_speed_delta',
+                       'prob_precip_delta']
+
+def prepare_avf_compare(airport_name, fcst_date_str):
+    # Compute the comparison rows for one airport and date. Only reads from
+    # the db, so it can run in worker processes.
+    df_avf_compare = get_avf_compare(airport_name, fcst_date_str)
+    df_avf_compare['airport_name'] = airport_name
+
+    for c in avf_compare_columns:
+        if c not in df_avf_compare.columns:
+            df_avf_compare[c] = np.nan
+
+    # Ensure only listed columns are included ordered correctly            
+    df_avf_compare = df_avf_compare[avf_compare_columns]
+
+    # Time stamps are stored as text
+    df_avf_compare['datetime'] = df_avf_compare['datetime'].astype(str)
+
+    return df_avf_compare
+
+def insert_avf_compare(db_conn, airport_name, fcst_date_str, df_avf_compare,
+                       update_rollup = True):
+    # Insert prepared comparison rows and fold them into the heatmap rollup.
+    # Does not commit, so callers can batch several into one transaction.
+    rows = df_avf_compare.astype(object).where(df_avf_compare.notna(), None)
+    cur = db_conn.cursor()
+    cur.executemany(
+        'INSERT INTO weather_avf_compare ({0}) VALUES ({1})'.format(
+            ','.join(avf_compare_columns), ','.join('?' * len(avf_compare_columns))
+        ),
+        rows.itertuples(index=False, name=None)
+    )
+    fill_time_columns(db_conn, 'weather_avf_compare', airport_name, commit = False)
+    if update_rollup:
+        update_avf_rollup(db_conn, airport_name, fcst_date_str, commit = False)
+
+def delete_avf_compare(db_conn, airport_name, fcst_date_str):
+    # Remove the comparison rows for a date, with the same date window as
+    # check_nws_avf_compare_loaded. Leaves the rollup alone and does not
+    # commit.
+    fcst_date_time = datetime.strptime(fcst_date_str, '%Y-%m-%d')
+    next_date_str = (fcst_date_time + timedelta(days = 1)).strftime('%Y-%m-%d')
+    db_conn.execute(
+        '''
+        DELETE FROM weather_avf_compare
+        WHERE airport_name = ?
+        AND datetime >= ?
+        AND datetime <  ?
+        ''',
+        (airport_name, fcst_date_str, next_date_str)
+    )
 
+def update_nws_avf_compare_db(db_conn, airport_name, fcst_date_str):
     # Check if data is loaded
     data_loaded = check_nws_avf_compare_loaded(db_conn, airport_name, fcst_date_str)    
 
@@ -201,24 +260,16 @@ def update_nws_avf_compare_db(db_conn, airport_name, fcst_date_str):
         print('Updating AvF for {0} on {1}'.format(airport_name, fcst_date_str))
         
         try:
-            df_avf_compare = get_avf_compare(airport_name, fcst_date_str)
-            df_avf_compare['airport_name'] = airport_name
-
-            
-            for c in columns:
-                if c not in df_avf_compare.columns:
-                    df_avf_compare[c] = np.nan
-
-            # Ensure only listed columns are included ordered correctly            
-            df_avf_compare = df_avf_compare[columns]
+            df_avf_compare = prepare_avf_compare(airport_name, fcst_date_str)
         
             # Load data        
-            df_avf_compare.to_sql('weather_avf_compare', index=False,
-                                  con = db_conn, if_exists='append')
+            insert_avf_compare(db_conn, airport_name, fcst_date_str, df_avf_compare)
+            db_conn.commit()
 
-        except:
+        except Exception as e:
+            db_conn.rollback()
             print(('something went wrong loading avf compare ' + 
-                   'for {0} for comparison date {1}'.format(airport_name, fcst_date_str)))
+                   'for {0} for comparison date {1}: {2!r}'.format(airport_name, fcst_date_str, e)))
 
 def update_actl_db_from_disk(db_conn, data_input_root, airport_list, actl_dt):
     # Load data for each airport
@@ -260,12 +311,13 @@ def update_fcst_db_from_disk(db_conn, data_input_root, airport_list, pull_dt):
 
             
 def update_avf_db_from_list(db_conn, airport_list, fcst_date_str):
-    for airport_name in airport_list:        
-        update_nws_avf_compare_db(db_conn, airport_name, fcst_date_str)                            
+    # Each slice of fcst and actl is read from the db once for the batch
+    with loader_memo():
+        for airport_name in airport_list:        
+            update_nws_avf_compare_db(db_conn, airport_name, fcst_date_str)                            
 
         
-def update_all_db_from_disk(db_conn, data_input_root, df_airports, 
-                            update_list, last_actl_date_str):
+def update_all_db_from_disk(db_conn, data_input_root, update_list, last_actl_date_str):
     # Dates to update
     last_actl_date_strtime = datetime.strptime(last_actl_date_str, '%Y-%m-%d')
     pull_datetime = last_actl_date_strtime + timedelta(days = 1)
@@ -1,69 +1,108 @@
 import os
+import io
+import hashlib
+from datetime import datetime, timezone
 from flask import (    
     Flask, render_template, escape,
     request, g, jsonify, url_for,
-    send_from_directory
+    send_from_directory, make_response, stream_with_context
 )
-import sqlite3
-import pandas as pd
-from forecast_tools import get_avf_heatmaps, get_fvf_heatmap_csv
+from error_stats import error_stat_names, avf_error_metrics, fvf_cube_channels
+from response_cache import get_or_compute, get_data_generation, make_cache_key
+from response_formats import rows_to_columnar, rows_to_packed, stream_json_records
+from airport_catalog import get_airport_catalog
+from db_connections import get_read_connection
+from time_columns import local_date_to_utc_epoch
 
 
-from db_setup import weather_db_loc, airport_list_loc
-
-import os
-
 app = Flask(__name__)
 
 def get_db():
-    db = getattr(g, '_database', None)
-    if db is None:
-        db = g._database = sqlite3.connect(weather_db_loc)
-    return db
+    # Read-only connection reused across requests
+    return get_read_connection()
+
+def conditional_response(name, params, make_body):
+    # The ETag depends only on the request parameters and the ingest
+    # generation, so revalidation is answered before any query runs
+    generation, updated_at = get_data_generation()
+    etag = hashlib.sha1(
+        make_cache_key(generation, name, params).encode('utf-8')
+    ).hexdigest()
+    last_modified = datetime.fromtimestamp(int(updated_at), timezone.utc)
+
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    elif request.if_modified_since is not None:
+        if_modified_since = request.if_modified_since
+        if if_modified_since.tzinfo is None:
+            if_modified_since = if_modified_since.replace(tzinfo = timezone.utc)
+        not_modified = last_modified <= if_modified_since
+    else:
+        not_modified = False
+
+    if not_modified:
+        response = app.response_class(status = 304)
+    else:
+        response = make_response(make_body())
 
-@app.teardown_appcontext
-def close_connection(exception):
-    db = getattr(g, '_database', None)
-    if db is not None:
-        db.close()
+    # Browsers must revalidate, which is cheap
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'no-cache'
+
+    return response
 
 @app.route('/weather-app')
 def airport_dropdown():
-    airport_data = pd.read_csv(airport_list_loc)
-    airport = airport_data['icao_designation'].values
-    city    = airport_data['city'].values
-    state   = airport_data['state'].values    
+    airport_catalog = get_airport_catalog()
     
     return render_template(
         'index.html',
-        airport=airport,
-        city=city,
-        state=state,
+        airport_options=airport_catalog.dropdown_html(),
         selected_airport="KORD"
     )
 
-@app.route('/weather-app/query', methods=['GET'])
-def query():
-    # Read the airport from the url
-    af_type = request.args.get('af_type')
-    airport = request.args.get('airport')
-    start_date_str = request.args.get('start_date_str')
-    end_date_str   = request.args.get('end_date_str')    
+# (series column, time column, shape column) used when downsampling
+downsample_columns = {
+    'fcst' : ('pull_date', 'forecast_time_stamps', 'temperature_hourly'),
+    'actl' : (None, 'datetime', 'air_temp'),
+    'avf'  : ('pull_date', 'datetime', 'temp_delta'),
+}
 
-    print(start_date_str, end_date_str)
-    
-    if af_type is None:
-        af_type = 'fcst'
-    
-    if airport is None:
-        airport = 'KORD'        
-        
-    db = get_db()    
-    c  = db.cursor()
+af_type_aliases = {
+    'forecast' : 'fcst',
+    'actual'   : 'actl',
+    'compare'  : 'avf',
+}
+
+def get_max_points():
+    # Optional bound on points per series
+    max_points = request.args.get('max_points', type = int)
+    if max_points is not None and max_points < 3:
+        max_points = None
+    return max_points
+
+def downsample_query_rows(af_type, columns, rows, max_points):
+    if max_points is None:
+        return rows
+
+    # numpy is only loaded once a request asks for downsampling
+    from downsample import downsample_rows
+
+    group_col, x_col, y_col = downsample_columns[af_type_aliases.get(af_type, af_type)]
+    return downsample_rows(columns, rows, max_points, x_col, y_col, group_col)
+
+def execute_weather_query(c, af_type, airport, start_date_str, end_date_str):
+    # Local dates to a UTC epoch range, [start midnight, end midnight)
+    tz_str = get_airport_catalog().time_zone(airport)
+    query_params = (
+        airport,
+        local_date_to_utc_epoch(start_date_str, tz_str),
+        local_date_to_utc_epoch(end_date_str, tz_str)
+    )
 
     if af_type in ('fcst','forecast'):
-        query_params = (airport, start_date_str, end_date_str)        
-        query = c.execute(        
+        c.execute(        
             '''
             SELECT 
              pull_date
@@ -73,16 +112,15 @@ def query():
             ,temperature_hourly
             FROM weather_fcst 
             WHERE airport_name = ?
-              AND forecast_time_stamps >= ?
-              AND forecast_time_stamps <= ?
-            ORDER BY pull_date, forecast_time_stamps
+              AND forecast_utc_epoch >= ?
+              AND forecast_utc_epoch <  ?
+            ORDER BY pull_date, forecast_utc_epoch
             ''',
             query_params
         )
 
     elif af_type in ('actl','actual'):
-        query_params = (airport, start_date_str, end_date_str)        
-        query = c.execute(        
+        c.execute(        
             '''
             SELECT 
              datetime
@@ -92,45 +130,238 @@ def query():
             ,air_temp
             FROM weather_actl 
             WHERE airport_name = ?
-              AND datetime >= ?
-              AND datetime <= ?
-            ORDER BY datetime
+              AND datetime_utc_epoch >= ?
+              AND datetime_utc_epoch <  ?
+            ORDER BY datetime_utc_epoch
+            ''',
+            query_params
+        )
+
+    elif af_type in ('avf', 'compare'):
+        c.execute(        
+            '''
+            SELECT 
+             pull_date
+            ,datetime
+            ,interp_day
+            ,interp_hour
+            ,temp_delta
+            ,wind_speed_delta
+            FROM weather_avf_compare 
+            WHERE airport_name = ?
+              AND datetime_utc_epoch >= ?
+              AND datetime_utc_epoch <  ?
+            ORDER BY pull_date, datetime_utc_epoch
             ''',
             query_params
         )
+
+    return c
+
+@app.route('/weather-app/query', methods=['GET'])
+def query():
+    # Read the airport from the url
+    af_type = request.args.get('af_type')
+    airport = request.args.get('airport')
+    start_date_str = request.args.get('start_date_str')
+    end_date_str   = request.args.get('end_date_str')    
+    out_format     = request.args.get('format', 'records')
+    max_points     = get_max_points()
+    stream         = request.args.get('stream', '0') in ('1', 'true')
+
+    print(start_date_str, end_date_str)
+    
+    if af_type is None:
+        af_type = 'fcst'
+    
+    if airport is None:
+        airport = 'KORD'        
         
+    def make_body():
+        db = get_db()    
+        c  = db.cursor()
+        execute_weather_query(c, af_type, airport, start_date_str, end_date_str)
+
+        # Records streamed straight from the cursor. Downsampling needs the
+        # whole series, so it is not streamed.
+        if stream and out_format == 'records' and max_points is None:
+            return app.response_class(
+                stream_with_context(stream_json_records(c)),
+                mimetype = 'application/json'
+            )
+
+        rows = c.fetchall()
+        columns = [desc[0] for desc in c.description]
+        rows = downsample_query_rows(af_type, columns, rows, max_points)
 
-    rows = query.fetchall()
-    columns = [desc[0] for desc in c.description]
-    result = []
-    for row in rows:
-        row = dict(zip(columns, row))
-        result.append(row)
+        # {column : [values...]}
+        if out_format == 'columnar':
+            return jsonify(rows_to_columnar(columns, rows))
 
-    return jsonify(result)
+        # Packed little-endian column blocks, layout in the headers
+        elif out_format == 'packed':
+            body, layout = rows_to_packed(columns, rows)
+            response = make_response(body)
+            response.mimetype = 'application/octet-stream'
+            response.headers['X-Columns']   = ','.join(layout)
+            response.headers['X-Row-Count'] = str(len(rows))
+            return response
+
+        result = []
+        for row in rows:
+            row = dict(zip(columns, row))
+            result.append(row)
+
+        return jsonify(result)
+
+    return conditional_response(
+        'query',
+        (af_type, airport, start_date_str, end_date_str, out_format, max_points, stream),
+        make_body
+    )
+
+
+@app.route('/weather-app/query_combined', methods=['GET'])
+def query_combined():
+    # Forecast and actual series (and optionally the AvF comparison rows)
+    # for one airport and date range, from one connection
+    airport = request.args.get('airport')
+    start_date_str = request.args.get('start_date_str')
+    end_date_str   = request.args.get('end_date_str')    
+    include_avf    = request.args.get('include_avf', '0') in ('1', 'true')
+    out_format     = request.args.get('format', 'records')
+    max_points     = get_max_points()
+
+    if airport is None:
+        airport = 'KORD'        
+
+    af_types = ['fcst', 'actl']
+    if include_avf:
+        af_types.append('avf')
+
+    def make_body():
+        db = get_db()    
+        c  = db.cursor()
+
+        result = {}
+        for af_type in af_types:
+            execute_weather_query(c, af_type, airport, start_date_str, end_date_str)
+            rows = c.fetchall()
+            columns = [desc[0] for desc in c.description]
+            rows = downsample_query_rows(af_type, columns, rows, max_points)
+
+            if out_format == 'columnar':
+                result[af_type] = rows_to_columnar(columns, rows)
+            else:
+                result[af_type] = [dict(zip(columns, row)) for row in rows]
+
+        return jsonify(result)
+
+    return conditional_response(
+        'query_combined',
+        (airport, start_date_str, end_date_str, include_avf, out_format, max_points),
+        make_body
+    )
 
 
 @app.route('/weather-app/avf_heatmap', methods=['GET'])
 def get_avf_heatmap():
     airport = request.args.get('airport')    
-    temp_heatmap_tbl, _ = get_avf_heatmaps(airport)
+    stat    = request.args.get('stat', 'bias')
+    if stat not in error_stat_names:
+        stat = 'bias'
 
-    # Data labels
-    columns   = list(temp_heatmap_tbl.columns)
-    row_names = list(temp_heatmap_tbl.index)
+    def compute():
+        # pandas is only loaded on the heatmap paths, and only on a cache miss
+        from forecast_tools import get_avf_heatmaps
+        temp_heatmap_tbl, _ = get_avf_heatmaps(airport, stat)
 
-    # Convert the table to csv
-    temp_heatmap_str = temp_heatmap_tbl.to_csv(index=False)
+        # Convert the table to csv
+        return temp_heatmap_tbl.to_csv(index=False)
 
-    return temp_heatmap_str
+    # Shared across worker processes until the next ingest
+    return conditional_response(
+        'avf_heatmap', (airport, stat),
+        lambda: get_or_compute('avf_heatmap', (airport, stat), compute)
+    )
 
 
 @app.route('/weather-app/fvf_heatmap', methods=['GET'])
 def get_fvf_heatmap():
     airport = request.args.get('airport')    
-    fvf_heatmap_flat_csv = get_fvf_heatmap_csv(airport)
-    
-    return fvf_heatmap_flat_csv
+    stat    = request.args.get('stat', 'bias')
+    if stat not in error_stat_names:
+        stat = 'bias'
+
+    # format=npy returns the dense cube (see get_fvf_heatmap_cube) as a
+    # .npy file
+    if request.args.get('format', 'csv') == 'npy':
+        def compute():
+            from forecast_tools import get_fvf_heatmap_cube, save_fvf_heatmap_cube
+            cube, _ = get_fvf_heatmap_cube(airport, stat)
+            body = io.BytesIO()
+            save_fvf_heatmap_cube(body, cube)
+            return body.getvalue()
+
+        response = conditional_response(
+            'fvf_heatmap_cube', (airport, stat),
+            lambda: get_or_compute('fvf_heatmap_cube', (airport, stat), compute)
+        )
+        response.headers['Content-Type'] = 'application/octet-stream'
+        response.headers['X-Channels'] = ','.join(fvf_cube_channels)
+        return response
+
+    def compute_csv():
+        from forecast_tools import get_fvf_heatmap_csv
+        return get_fvf_heatmap_csv(airport, stat)
+
+    return conditional_response(
+        'fvf_heatmap', (airport, stat),
+        lambda: get_or_compute('fvf_heatmap', (airport, stat), compute_csv)
+    )
+
+@app.route('/weather-app/region_heatmap', methods=['GET'])
+def get_region_heatmap():
+    # Heatmap for several airports at once: airports=KORD,KMDW or state=IL
+    # or time_zone=US/Central (America/Chicago is also accepted). Merges the
+    # per-airport rollups, so the cost barely depends on the number of
+    # airports.
+    airports = request.args.get('airports')
+    airports = [a.strip() for a in airports.split(',') if a.strip()] if airports else None
+    airport_list = sorted(get_airport_catalog().select(
+        airports,
+        request.args.get('state'),
+        request.args.get('time_zone')
+    ))
+    if len(airport_list) == 0:
+        return 'No airports selected', 400
+
+    kind   = request.args.get('kind', 'avf')
+    stat   = request.args.get('stat', 'bias')
+    metric = request.args.get('metric', 'temp_delta')
+    if stat not in error_stat_names:
+        stat = 'bias'
+    if metric not in avf_error_metrics:
+        metric = 'temp_delta'
+
+    if kind == 'fvf':
+        def compute():
+            from forecast_tools import get_fvf_heatmap_csv
+            return get_fvf_heatmap_csv(airport_list, stat)
+    else:
+        kind = 'avf'
+        def compute():
+            from forecast_tools import get_avf_heatmaps
+            heatmap_tbl, = get_avf_heatmaps(airport_list, stat, (metric,))
+            return heatmap_tbl.to_csv(index=False)
+
+    params = (kind, stat, metric, ','.join(airport_list))
+    response = conditional_response(
+        'region_heatmap', params,
+        lambda: get_or_compute('region_heatmap', params, compute)
+    )
+    response.headers['X-Airports'] = ','.join(airport_list)
+    return response
 
 @app.route('/weather-app/static/<path:path>', methods=['GET'])
 def get_static(path):